@@ -5,21 +5,79 @@ Assignment 1: Search (A* Algorithm)
 @contact: sanozan@fel.cvut.cz
 '''
 
+import heapq
+import itertools
 import time
 import kuimaze
 import os
 
 
 
-from heuristics import heur
+from anytime import AnytimeAStar, WEIGHT
+from bidirectional import BidirectionalAStar
+from distance_field import get_field
+from heuristics import GoalIndex, heur, select_heuristic
+from hpa import get_abstraction
+from jps import JumpPointSearch
+from landmarks import LandmarkHeuristic
+from search_grid import SearchGrid, gradient_offset
+from search_stats import SearchStats
 
 class Agent(kuimaze.BaseAgent):
     '''
     Simple example of agent class that inherits kuimaze.BaseAgent class 
     '''
-    def __init__(self, environment):
+    # Open list implementations that find_path can run on.
+    # 'heap' is the default, 'list' is the original list-scan version,
+    # kept around for comparison (see benchmark.py).
+    # 'array' runs on the flat arrays of a SearchGrid instead of expand.
+    # 'jps' is Jump Point Search, it falls back to 'array' when the moves
+    # do not cost their length (gradient or hard places).
+    # 'bidirectional' searches from both ends of the maze at once; it pays
+    # off on large open maps, not on the small bundled ones (see benchmark.py).
+    # 'multigoal' goes to the nearest of all goals, not only the first one.
+    # 'field' reads the path off the cached distance field of the goal.
+    # 'hpa' is hierarchical A* over clusters of the maze, its path smoothed
+    # piece by piece (see hpa.Abstraction._smooth), near-optimal only; for
+    # large maps queried many times, like generated mazes (see _find_path_hpa).
+    ENGINES = {
+        'heap': '_find_path_heap',
+        'list': '_find_path_list',
+        'array': '_find_path_array',
+        'jps': '_find_path_jps',
+        'bidirectional': '_find_path_bidirectional',
+        'multigoal': '_find_path_multigoal',
+        'field': '_find_path_field',
+        'hpa': '_find_path_hpa',
+    }
+    # 'euclidean' is heur, 'auto' is the tightest admissible heuristic
+    # for the gradient and hard places of the environment, 'landmarks' is
+    # the ALT heuristic, with its distance tables stored on disk.
+    # The 'list' and 'multigoal' engines always use heur.
+    HEURISTICS = ('euclidean', 'auto', 'landmarks')
+
+    def __init__(self, environment, engine='heap', heuristic='euclidean', stats=False):
+        if engine not in self.ENGINES:
+            raise ValueError('Unknown engine {!r}, expected one of {}'.format(
+                engine, sorted(self.ENGINES)))
+        if heuristic not in self.HEURISTICS:
+            raise ValueError('Unknown heuristic {!r}, expected one of {}'.format(
+                heuristic, list(self.HEURISTICS)))
         self.environment = environment
-        
+        self.engine = engine
+        self.heuristic = heuristic
+        self._grid = None
+        self._grid_version = None
+        self._landmarks = None
+        self._abstraction = None
+        self.expanded = 0 # Number of nodes closed by the last find_path.
+        self.peak_open = 0 # Largest size of the openList in the last find_path.
+        self.elapsed = 0.0 # Wall-clock time of the last find_path, in seconds.
+        # stats: False, True to keep a SearchStats of each find_path in
+        # self.stats, or a function that is also called with it.
+        self._stats_hook = stats
+        self.stats = None
+
     def find_path(self):
         '''
         A* Pathfinding Algorithm implementation.
@@ -32,14 +90,470 @@ class Agent(kuimaze.BaseAgent):
                 in the form [(x1, y1), (x2, y2)...].
         Expects to return a path_section as a list of positions [(x1, y1), (x2, y2), ... ].
         '''
+        if not self._stats_hook:
+            self.stats = None
+            started = time.perf_counter()
+            path = getattr(self, self.ENGINES[self.engine])()
+            self.elapsed = time.perf_counter() - started
+            return path
+        # The engines time their parts only when self.stats is set.
+        self.stats = stats = SearchStats(self.engine, self.heuristic)
+        started = time.perf_counter()
+        path = getattr(self, self.ENGINES[self.engine])()
+        self.elapsed = time.perf_counter() - started
+        stats.elapsed = self.elapsed
+        stats.expanded = self.expanded
+        stats.peak_open = self.peak_open
+        stats.found = path is not None
+        stats.path_length = len(path) if path else 0
+        if callable(self._stats_hook):
+            self._stats_hook(stats)
+        return path
+
+    def stream_path(self):
+        '''
+        The search of the 'array' engine, but the path comes as a generator
+        of positions (SearchGrid.iter_path), so a very long path is never
+        held in a list, reversed or not. Hand it to environment.set_path,
+        or write it out as it comes. It reads the search buffers of the
+        grid, so consume it before the next search of this agent.
+        
+        Returns:
+            generator: (x, y) from the start to the goal, or None if there is no path.
+        '''
+        # Not timed, and self.stats of an earlier find_path does not describe this search.
+        self.stats = None
+        started = time.perf_counter()
+        path = self._find_path_array(stream=True)
+        self.elapsed = time.perf_counter() - started
+        return path
+
+    def _find_path_heap(self):
+        '''
+        A* with a binary heap as the openList.
+        
+        Nodes are never updated inside the heap (heapq cannot do decrease-key).
+        Instead, a better entry is pushed, and the old one is skipped when it
+        is popped (lazy deletion). best_g tells which entry is the current one.
+        
+        Returns:
+            list: Shortest path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+
+        heuristic = self.get_heuristic()
+        expand = self.environment.expand
+        heappush, heappop = heapq.heappush, heapq.heappop
+        stats = self.stats
+        if stats is not None:
+            heuristic = stats.timed(heuristic, 'heuristic_time')
+            expand = stats.timed(expand, 'expand_time')
+            heappush = stats.timed(heappush, 'queue_time')
+            heappop = stats.timed(heappop, 'queue_time')
+        parents = {start: None}
+        best_g = {start: 0} # Position -> best g cost found so far.
+        counter = itertools.count()
+        # The structure of the elements in openList:
+        # (f, h, order, g, (x, y)). Tuples compare element-wise, so the heap
+        # pops the lowest f, breaks ties with the lowest h, and then with
+        # the insertion order. (x, y) is never compared.
+        h = heuristic(start, goal)
+        openList = [(h, h, next(counter), 0, start)]
+        closedList = set()
+        self.peak_open = 0
+        while openList:
+            if len(openList) > self.peak_open:
+                self.peak_open = len(openList)
+            f, h, _, g, pos = heappop(openList)
+            if pos in closedList or g > best_g[pos]:
+                continue # Stale entry, a cheaper one was pushed later.
+            closedList.add(pos)
+            self.expanded = len(closedList)
+            if pos == goal:
+                self._record_pushes(counter, len(best_g))
+                return self._reconstruct_path(parents, goal)
+            for child, moveCost in expand(pos):
+                if child in closedList:
+                    continue
+                newCost = g + moveCost
+                if child in best_g and best_g[child] <= newCost:
+                    continue # We do not beat the known cost.
+                best_g[child] = newCost
+                parents[child] = pos
+                h = heuristic(child, goal)
+                heappush(openList, (newCost + h, h, next(counter), newCost, child))
+        self._record_pushes(counter, len(best_g))
+        return None # No path found.
+
+    def _record_pushes(self, counter, distinct):
+        '''
+        Fills generated and reopened of self.stats at the end of a search.
+        Every push took one number of the counter, and each of the distinct
+        pushed nodes was pushed once before it could be pushed again.
+        '''
+        if self.stats is not None:
+            self.stats.generated = next(counter)
+            self.stats.reopened = self.stats.generated - distinct
+
+    def get_heuristic(self):
+        '''
+        Returns the heuristic function h(first, second) that find_path uses.
+        '''
+        if self.heuristic == 'auto':
+            return select_heuristic(self.environment)
+        if self.heuristic == 'landmarks':
+            grid = self.get_grid()
+            if self._landmarks is None or self._landmarks[0] is not grid:
+                self._landmarks = (grid, LandmarkHeuristic(grid, self.environment.get_grad()))
+            return self._landmarks[1]
+        return heur
+
+    def _gradient_free_heuristic(self):
+        '''
+        get_heuristic for the costs without the gradient, on which the
+        'bidirectional' engine and find_path_anytime search.
+        '''
+        heuristic = self.get_heuristic()
+        grad = self.environment.get_grad()
+        if heuristic is heur or (grad[0] == 0 and grad[1] == 0):
+            return heuristic # heur bounds those costs already.
+        return lambda first, second: heuristic(first, second) - gradient_offset(grad, first, second)
+
+    def get_grid(self):
+        '''
+        Returns the SearchGrid of the environment, built on the first call,
+        and rebuilt after the costs of the environment change.
+        '''
+        version = self.environment.get_adjacency_version()
+        if self._grid is None or self._grid_version != version:
+            self._grid = SearchGrid(self.environment)
+            self._grid_version = version
+        return self._grid
+
+    def _find_path_array(self, stream=False):
+        '''
+        A* over the flat arrays of a SearchGrid.
+        
+        Same search as _find_path_heap (same costs, same tie-breaking, same
+        order of children), so it returns the same path. Parents, g costs and
+        the closed set live in preallocated arrays indexed by y*W + x, and
+        children come from the precomputed move bitmask, so the only thing
+        allocated per node is its heap entry.
+        Note: it does not go through expand, so render() shows no visited cells.
+        
+        Returns:
+            list: Shortest path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        grid = self.get_grid()
+        heuristic = self.get_heuristic()
+        if heuristic is heur:
+            return self._search_array(start, {grid.index(goal)}, lambda index: grid.heuristic(index, goal), stream)
+        return self._search_array(start, {grid.index(goal)}, lambda index: heuristic(grid.position(index), goal),
+                                  stream)
+
+    def _find_path_multigoal(self):
+        '''
+        A* to the cheapest reachable goal of all goals in the observation,
+        in a single search.
+        
+        The heuristic is the distance to the nearest goal, looked up in a
+        GoalIndex (2-d tree), and the search stops at the first goal closed.
+        
+        Returns:
+            list: Shortest path to the nearest goal as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        start = observation[0][0:2]
+        goals = [goal[0:2] for goal in observation[1:]]
+        grid = self.get_grid()
+        goal_index = GoalIndex(goals)
+        width = grid.width
+        return self._search_array(start, {grid.index(goal) for goal in goals},
+                                  lambda index: goal_index.distance((index % width, index // width)))
+
+    def _search_array(self, start, targets, heuristic, stream=False, generation=None):
+        '''
+        The A* loop of the array engines.
+        
+        Args:
+            start: (x, y) of the start.
+            targets: set of flat indices, the search stops at the first one closed.
+            heuristic: function of a flat index.
+            stream: return the path as a generator (SearchGrid.iter_path) instead of a list.
+            generation: number from SearchGrid.next_generation, to search
+                without clearing the buffers first (see find_paths); None
+                clears them.
+        
+        Returns:
+            list: Path from start to the target as [(x1, y1), (x2, y2)...], or None.
+        '''
+        grid = self.get_grid()
+        if generation is None:
+            grid.reset_buffers()
+            generation = grid.next_generation()
+        # memoryviews index the NumPy buffers with plain python numbers,
+        # which is a lot faster than indexing the arrays themselves.
+        parents = memoryview(grid.parents)
+        g_cost = memoryview(grid.g)
+        closed = memoryview(grid.closed)
+        seen = memoryview(grid.seen)
+        moves = memoryview(grid.moves)
+        hard = memoryview(grid.hard)
+        steps = [step[:3] for step in grid.steps]
+
+        heappush, heappop = heapq.heappush, heapq.heappop
+        stats = self.stats
+        if stats is not None:
+            heuristic = stats.timed(heuristic, 'heuristic_time')
+            heappush = stats.timed(heappush, 'queue_time')
+            heappop = stats.timed(heappop, 'queue_time')
+
+        source = grid.index(start)
+        seen[source] = generation
+        g_cost[source] = 0
+        parents[source] = -1
+        self.expanded = 0
+        self.peak_open = 0
+        counter = itertools.count()
+        h = heuristic(source)
+        openList = [(h, h, next(counter), 0, source)]
+        while openList:
+            if len(openList) > self.peak_open:
+                self.peak_open = len(openList)
+            f, h, _, g, node = heappop(openList)
+            if closed[node] == generation or g > g_cost[node]:
+                continue # Stale entry.
+            closed[node] = generation
+            self.expanded += 1
+            if node in targets:
+                if stats is not None:
+                    self._record_pushes(counter, grid.reached())
+                return grid.iter_path(node) if stream else grid.path_to(node)
+            mask = moves[node]
+            addition = hard[node]
+            for bit, offset, base in steps:
+                if not mask & bit:
+                    continue
+                child = node + offset
+                if closed[child] == generation:
+                    continue
+                newCost = g + (base + addition)
+                # g of a cell only counts if it was set in this search.
+                if seen[child] == generation and g_cost[child] <= newCost:
+                    continue
+                seen[child] = generation
+                g_cost[child] = newCost
+                parents[child] = node
+                h = heuristic(child)
+                heappush(openList, (newCost + h, h, next(counter), newCost, child))
+        if stats is not None:
+            self._record_pushes(counter, grid.reached())
+        return None # No path found.
+
+    def find_paths(self, queries):
+        '''
+        Answers many path queries on the environment at once.
+        
+        No reset() between the queries, and no clearing of the search
+        buffers either: each query is a new generation of the SearchGrid
+        (see SearchGrid.next_generation), so it costs only the nodes it
+        touches. Each query is the same A* as the 'array' engine, with the
+        heuristic of the agent.
+        
+        Args:
+            queries: iterable of (start, goal) pairs of positions (x, y).
+        
+        Returns:
+            list: For each query, its path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        grid = self.get_grid()
+        heuristic = self.get_heuristic()
+        width = grid.width
+        self.stats = None
+        expanded = 0
+        peak_open = 0
+        paths = []
+        for start, goal in queries:
+            goal = (goal[0], goal[1])
+            if heuristic is heur:
+                h_of = lambda index: grid.heuristic(index, goal)
+            else:
+                h_of = lambda index: heuristic((index % width, index // width), goal)
+            paths.append(self._search_array(start, {grid.index(goal)}, h_of, generation=grid.next_generation()))
+            expanded += self.expanded
+            peak_open = max(peak_open, self.peak_open)
+        self.expanded = expanded
+        self.peak_open = peak_open
+        return paths
+
+    def distance_field(self, goal=None):
+        '''
+        Returns the DistanceField of the goal (see distance_field.py), from
+        which distance_field(goal).path_from(start) gives the optimal path
+        from any start in O(path length). The field is shared by all
+        gradients of the map, so pass environment.get_grad() to its
+        distance() and to_array() to get the costs of this environment.
+        
+        Args:
+            goal: (x, y), the first goal of the maze if None.
+        '''
+        if goal is None:
+            goal = self.environment.reset()[1]
+        return get_field(self.get_grid(), goal[0:2])
+
+    def _find_path_field(self):
+        '''
+        Optimal path read off the distance field of the goal. The field is
+        computed by the first search to the goal, and reused by later ones.
+        
+        Returns:
+            list: Shortest path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        self.expanded = 0
+        self.peak_open = 0
+        return self.distance_field(goal).path_from(start)
+
+    def get_abstraction(self):
+        '''
+        Returns the HPA* Abstraction of the maze (see hpa.py). After the
+        maze changes, only the clusters that the change touched are rebuilt.
+        '''
+        grid = self.get_grid()
+        if self._abstraction is None or self._abstraction.digest != grid.digest():
+            self._abstraction = get_abstraction(grid, previous=self._abstraction)
+        return self._abstraction
+
+    def _find_path_hpa(self):
+        '''
+        Hierarchical A*, see hpa.py: A* between the entrances of the
+        clusters of the maze, then A* inside each cluster on the way.
+
+        Worth it on large maps, a few hundred cells a side, with many queries
+        per map: on generated 401x401 mazes (map_generator 'kruskal' or
+        'division') it expands about 60% fewer nodes than 'array' per query,
+        after building the abstraction once in a few seconds. On the small
+        bundled maps and for a single query, plain A* is cheaper.
+        
+        Returns:
+            list: Near-optimal path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        abstraction = self.get_abstraction()
+        path = abstraction.find_path(start, goal)
+        self.peak_open = 0
+        if path is not None:
+            path = list(path) # Runs the searches inside the clusters.
+        self.expanded = abstraction.expanded
+        return path
+
+    def _find_path_jps(self):
+        '''
+        Jump Point Search, see jps.py.
+        
+        Returns the same path cost as A* on mazes where every move costs its
+        length, while closing only the jump points. On other mazes it runs
+        the array A* engine instead.
+        
+        Returns:
+            list: Shortest path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        grid = self.get_grid()
+        if not grid.uniform:
+            return self._find_path_array()
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        planner = JumpPointSearch(grid, self.get_heuristic())
+        path = planner.find_path(start, goal)
+        self.expanded = planner.expanded
+        self.peak_open = planner.peak_open
+        return path
+
+    def _find_path_bidirectional(self):
+        '''
+        Bidirectional A*, see bidirectional.py.
+        
+        Returns:
+            list: Shortest path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        planner = BidirectionalAStar(self.get_grid(), self._gradient_free_heuristic())
+        path = planner.find_path(start, goal)
+        self.expanded = planner.expanded
+        self.peak_open = planner.peak_open
+        return path
+
+    def find_path_anytime(self, deadline=None, epsilon=0.0, weight=WEIGHT):
+        '''
+        Anytime A* (ARA*), see anytime.py: a first path from a search with
+        weight times the heuristic, then better ones as the weight goes
+        down to 1, until the path is within 1 + epsilon of the optimal one
+        or deadline seconds have passed.
+        
+        Args:
+            deadline: time budget in seconds, None to run until epsilon is met.
+            epsilon: accepted suboptimality, 0 runs until the path is optimal.
+            weight: inflation of the heuristic in the first search.
+        
+        Returns:
+            generator: anytime.Solution(path, cost, bound) for each path found,
+                with path as [(x1, y1), (x2, y2)...].
+        '''
+        observation = self.environment.reset()
+        goal = observation[1][0:2]
+        start = observation[0][0:2]
+        planner = AnytimeAStar(self.get_grid(), self._gradient_free_heuristic(), self.environment.get_grad())
+        for solution in planner.search(start, goal, deadline, epsilon, weight):
+            self.expanded = planner.expanded
+            self.peak_open = planner.peak_open
+            yield solution
+
+    @staticmethod
+    def _reconstruct_path(parents, goal):
+        '''
+        Backtracks the parents from the goal, and returns the path from the start.
+        '''
+        path = []
+        node = goal
+        while node:
+            path.append(node)
+            node = parents[node]
+        return path[::-1]
+
+    def _find_path_list(self):
+        '''
+        A* with a plain python list as the openList.
+        
+        Every pop, and every child, scans the whole openList.
+        Kept as the reference implementation for benchmark.py.
+        '''
         observation = self.environment.reset() 
         goal = observation[1][0:2]
         start = observation[0][0:2]                               # initial state (x, y)
         
+        expand = self.environment.expand
+        h_of = heur
+        stats = self.stats
+        if stats is not None:
+            expand = stats.timed(expand, 'expand_time')
+            h_of = stats.timed(h_of, 'heuristic_time')
+        replaced = 0 # Entries of the openList updated with a lower cost.
         parents = {} # For fast access, we keep the parents in a dictionary
         parents[start] = None # Starting node has no parent
         openList = [] # OpenList is just a list containing nodes and costs
-        openList.append((start, heur(start, goal), 0, heur(start,goal)))
+        openList.append((start, h_of(start, goal), 0, h_of(start,goal)))
         # The structure of the elements in openList:
         # ((x, y), f, g, h), where (x,y) is the state, and f,g,h are costs, respectively.
         # Note: This is implementable with PriorityQueues as well,
@@ -52,7 +566,9 @@ class Agent(kuimaze.BaseAgent):
         # The entries in ClosedList are only positions (x,y) of the states.
         found_path = False
         # This variable is useful when we break our loop, and reconstruct the path.
+        self.peak_open = 0
         while openList: # While openList is not empty:
+            self.peak_open = max(self.peak_open, len(openList))
             # ... Find the node with the lowest f cost.
             current = openList[0] 
             for item in openList:
@@ -63,6 +579,7 @@ class Agent(kuimaze.BaseAgent):
             # If the f costs are the same (lowest), break the tie with h cost.
             openList.remove(current)
             closedList.add(current[0])
+            self.expanded = len(closedList)
             # The selected node is done with. We can remove it, and move on.
             if current[0] == goal:
                 # If the current node to be processed is the goal, we are done!
@@ -70,7 +587,7 @@ class Agent(kuimaze.BaseAgent):
                 found_path = True
                 break
             
-            children = self.environment.expand(current[0])
+            children = expand(current[0])
             # Explored children of the current node.
             for child in children:
                 # Structure of a child: ((x,y), moveCost)
@@ -99,20 +616,23 @@ class Agent(kuimaze.BaseAgent):
                 if (cost_beaten or not openList_contains_child):
                     pos = child[0]
                     g = newCost # candidate g cost.
-                    h = heur(child[0], goal) # O(1) operation. Cheap.
+                    h = h_of(child[0], goal) # O(1) operation. Cheap.
                     f = g + h
                     parents[child[0]] = current[0] # update or reset the parent.
                     # update (or set) the parent, since we've found a shorter path
                     
                     if cost_beaten: # This means it should be in the open list.
                         openList[index_of_beaten] = (pos, f, g, h)
+                        replaced += 1
                         # construct a new entry for openList
                         # in the form ((x,y), f, g, h)
                     elif not openList_contains_child:
                         # We should add the new child to the openList.
                         openList.append((pos, f, g, h))
-            #self.environment.render()
-            #time.sleep(0.05)
+        if stats is not None:
+            # Each node got its parent when it was added to the openList.
+            stats.generated = len(parents)
+            stats.reopened = replaced
         if found_path:
             path = []
             node = goal
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Anytime Repairing A* (Likhachev, Gordon & Thrun, 2003) over a SearchGrid:
+a first path quickly with an inflated heuristic, then better and better
+paths, each with a bound on how far it can be from the optimal one.
+"""
+
+import collections
+import heapq
+import itertools
+import time
+
+from heuristics import heur
+from search_grid import gradient_offset
+
+#: Weight of the heuristic in the first search.
+WEIGHT = 3.0
+#: The weight decreases by this much after each path.
+DECREMENT = 0.5
+#: Expanded nodes between two checks of the deadline.
+CHECK_EVERY = 64
+
+#: One answer of the anytime search. cost is the cost of the path as summed
+#: by expand, gradient included. bound does not apply to cost but to the
+#: cost without the gradient, cost - search_grid.gradient_offset(grad,
+#: start, goal): that one is at most bound times its optimum. With a
+#: gradient, cost can be zero or negative, and has no such bound (see
+#: AnytimeAStar). With no gradient both are the same.
+Solution = collections.namedtuple('Solution', ['path', 'cost', 'bound'])
+
+
+class AnytimeAStar:
+    '''
+    ARA* planner bound to one SearchGrid.
+
+    The bound of weighted A* only holds for costs that are not negative,
+    and a tilted move can cost less than zero, so the search runs on the
+    costs without the gradient (search_grid.gradient_offset), which is only
+    added to the reported cost. With no gradient the bound is simply
+    cost / optimal cost.
+
+    The heuristic must be admissible and consistent for those costs, which
+    heur is.
+    '''
+
+    def __init__(self, grid, heuristic=heur, grad=(0, 0)):
+        self.grid = grid
+        self.heuristic = heuristic
+        self.grad = (grad[0], grad[1])
+        self.steps = [(bit, offset, length) for bit, offset, _, _, _, length in grid.steps]
+        self.expanded = 0
+        self.peak_open = 0
+
+    def _path_cost(self, path):
+        # Cost without the gradient, the one the search minimises.
+        hard = self.grid.hard
+        width = self.grid.width
+        cost = 0
+        for (x, y), (nx, ny) in zip(path, path[1:]):
+            cost += pow(pow(nx - x, 2) + pow(ny - y, 2), 1/2) + hard[y * width + x]
+        return cost
+
+    def search(self, start, goal, deadline=None, epsilon=0.0, weight=WEIGHT, decrement=DECREMENT):
+        '''
+        Generator of ever better Solutions from start to goal, both (x, y).
+
+        Stops once the bound is at most 1 + epsilon, or when deadline
+        seconds have passed since the call. The first search always runs to
+        the end, so there is a path whenever the goal can be reached; the
+        deadline only cuts the improvements. Yields nothing if there is no path.
+        '''
+        started = time.perf_counter()
+        grid = self.grid
+        grid.reset_buffers()
+        self.expanded = 0
+        self.peak_open = 0
+        parents = memoryview(grid.parents)
+        g_cost = memoryview(grid.g)
+        moves = memoryview(grid.moves)
+        hard = memoryview(grid.hard)
+        width = grid.width
+        source = grid.index(start)
+        target = grid.index(goal)
+        goal = (goal[0], goal[1])
+        h_cache = {}
+
+        def h_of(node):
+            h = h_cache.get(node)
+            if h is None:
+                h = h_cache[node] = self.heuristic((node % width, node // width), goal)
+            return h
+
+        g_cost[source] = 0
+        opened = {source} # OPEN of ARA*, the nodes of openList that are not stale
+        inconsistent = set() # INCONS: improved after they were closed in this search
+        counter = itertools.count()
+        first = True
+        last = None # (cost without the gradient, bound) of the last Solution
+        while True:
+            # Rebuild the queue for the new weight, from OPEN and INCONS.
+            opened |= inconsistent
+            inconsistent = set()
+            openList = [(g_cost[node] + weight * h_of(node), next(counter), g_cost[node], node) for node in opened]
+            heapq.heapify(openList)
+            closed = bytearray(grid.size)
+            # ImprovePath: expand while some node may still lead to a
+            # cheaper path to the goal than the one already found.
+            while openList and openList[0][0] < g_cost[target]:
+                if len(openList) > self.peak_open:
+                    self.peak_open = len(openList)
+                f, _, g, node = heapq.heappop(openList)
+                if g > g_cost[node] or node not in opened:
+                    continue # Stale entry.
+                opened.discard(node)
+                closed[node] = 1
+                self.expanded += 1
+                if not first and deadline is not None and not self.expanded % CHECK_EVERY \
+                        and time.perf_counter() - started > deadline:
+                    return
+                mask = moves[node]
+                addition = hard[node]
+                for bit, offset, length in self.steps:
+                    if not mask & bit:
+                        continue
+                    child = node + offset
+                    newCost = g + (length + addition)
+                    if g_cost[child] <= newCost:
+                        continue
+                    g_cost[child] = newCost
+                    parents[child] = node
+                    if closed[child]:
+                        inconsistent.add(child)
+                    else:
+                        opened.add(child)
+                        heapq.heappush(openList, (newCost + weight * h_of(child), next(counter), newCost, child))
+            first = False
+            if g_cost[target] == float('inf'):
+                return # No path found.
+            # Every path to the goal goes through OPEN or INCONS, so the
+            # cheapest one costs at least the lowest g + h there.
+            lower = min((g_cost[node] + h_of(node) for node in opened | inconsistent), default=g_cost[target])
+            path = grid.path_to(target)
+            # A node improved after its children were expanded keeps them
+            # pointing at it, so the path can cost less than g of the goal.
+            reduced = self._path_cost(path)
+            bound = max(1.0, min(weight, reduced / lower)) if lower > 0 else 1.0
+            if last is None or reduced < last[0] or bound < last[1]:
+                last = (reduced, bound)
+                cost = reduced + gradient_offset(self.grad, start, goal)
+                yield Solution(path, cost, bound)
+            if bound <= 1 + epsilon or weight <= 1:
+                return
+            if deadline is not None and time.perf_counter() - started > deadline:
+                return
+            weight = max(1.0, weight - decrement)
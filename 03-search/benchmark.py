@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+'''
+Benchmark of the A* engines of agent.Agent on the bundled maps.
+  python3 benchmark.py openlist   default heap openList vs the original list-scan version
+  python3 benchmark.py jps        Jump Point Search vs array A*, in time and expanded nodes
+  python3 benchmark.py bidirectional   bidirectional A* vs array A*, the same way, plus large open maps
+  python3 benchmark.py heuristic  heur vs the gradient-aware and landmark heuristics, on sloped maps
+  python3 benchmark.py batch      Agent.find_paths vs reset() and a new Agent per query
+  python3 benchmark.py anytime    first and last path of anytime A* vs array A*
+  python3 benchmark.py replan     D* Lite repair after a few cell edits vs a search from scratch
+'''
+
+import argparse
+import contextlib
+import glob
+import io
+import os
+import random
+import time
+
+import numpy as np
+
+import kuimaze
+from kuimaze import map_compiler
+
+from agent import Agent
+from dstar_lite import DStarLite
+
+MAPS = 'maps/normal/*.bmp'
+GRAD = (0, 0)
+REPEATS = 5
+#: Gradients of the sloped maps in the heuristic comparison.
+SLOPES = [(0, 0), (0.3, 0), (0, -0.3), (0.5, 0.5), (-0.6, 0.2), (0.9, -0.9)]
+#: Number of random (start, goal) queries per map in the batch comparison.
+QUERIES = 1000
+#: Rounds of random cell edits per map, and edited cells per round, in the replan comparison.
+ROUNDS = 50
+EDITS = 3
+#: Large open maps of the bidirectional comparison, as (size, share of random walls).
+OPEN_MAPS = [(100, 0.1), (300, 0), (300, 0.1), (300, 0.25)]
+
+
+def make_env(map_image, grad=GRAD):
+    '''
+    Builds an InfEasyMaze, silencing the prints of Maze.__init__.
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        return kuimaze.InfEasyMaze(map_image=map_image, grad=grad)
+
+
+def path_cost(env, path):
+    '''
+    Sums the move costs along the path, as given by env.expand.
+    '''
+    cost = 0
+    for node, next_node in zip(path, path[1:]):
+        cost += dict(env.expand(node))[next_node]
+    return cost
+
+
+def run(env, engine, repeats=REPEATS, heuristic='euclidean'):
+    '''
+    Runs find_path repeatedly, and returns (best time in seconds, path, expanded nodes).
+    '''
+    agent = Agent(env, engine=engine, heuristic=heuristic)
+    best = float('inf')
+    path = None
+    for _ in range(repeats):
+        t = time.perf_counter()
+        path = agent.find_path()
+        best = min(best, time.perf_counter() - t)
+    return best, path, agent.expanded
+
+
+def maps():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return sorted(glob.glob(os.path.join(here, MAPS)))
+
+
+def open_maps(seed=0):
+    '''
+    Compiled size x size maps of OPEN_MAPS, with random single walls and
+    the start and the goal in opposite corners, named as 'open300-10%'.
+    '''
+    rng = np.random.default_rng(seed)
+    named = []
+    for size, density in OPEN_MAPS:
+        walls = rng.random((size, size)) < density
+        walls[0, 0] = walls[-1, -1] = False
+        named.append(('open{}-{:.0%}'.format(size, density),
+                      map_compiler.compile_walls(walls, (0, 0), [(size - 1, size - 1)])))
+    return named
+
+
+def compare_open_lists():
+    print('{:<16} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'map', 'list [ms]', 'heap [ms]', 'speedup', 'cost', 'path'))
+    for map_image in maps():
+        env = make_env(map_image)
+        list_time, list_path, _ = run(env, 'list')
+        heap_time, heap_path, _ = run(env, 'heap')
+        cost = path_cost(env, heap_path) if heap_path else None
+        list_cost = path_cost(env, list_path) if list_path else None
+        if heap_path == list_path:
+            same = 'same'
+        elif cost is not None and list_cost is not None and abs(cost - list_cost) < 1e-9:
+            same = 'equal cost'
+        else:
+            same = 'DIFFERENT'
+        print('{:<16} {:>10.2f} {:>10.2f} {:>8.1f} {:>10} {:>10}'.format(
+            os.path.basename(map_image), 1000 * list_time, 1000 * heap_time,
+            list_time / heap_time, '-' if cost is None else '{:.3f}'.format(cost), same))
+
+
+def compare_expansions(engine, extra=()):
+    '''
+    Compares the engine with array A* in time and expanded nodes,
+    on the bundled maps and the extra (name, map) pairs.
+    '''
+    print('{:<16} {:>10} {:>10} {:>9} {:>9} {:>7} {:>10}'.format(
+        'map', 'A* [ms]', 'new [ms]', 'A* exp.', 'new exp.', 'saved', 'cost'))
+    total = [0, 0]
+    for name, map_image in [(os.path.basename(map_image), map_image) for map_image in maps()] + list(extra):
+        env = make_env(map_image)
+        astar_time, astar_path, astar_expanded = run(env, 'array')
+        new_time, new_path, new_expanded = run(env, engine)
+        if engine == 'jps' and not Agent(env).get_grid().uniform:
+            saved = 'A*'  # gradient or hard places, JPS fell back to A*
+        else:
+            saved = '{:.0%}'.format(1 - new_expanded / astar_expanded)
+            total[0] += astar_expanded
+            total[1] += new_expanded
+        cost = '-'
+        if new_path:
+            assert abs(path_cost(env, new_path) - path_cost(env, astar_path)) < 1e-9
+            cost = '{:.3f}'.format(path_cost(env, new_path))
+        print('{:<16} {:>10.2f} {:>10.2f} {:>9} {:>9} {:>7} {:>10}'.format(
+            name, 1000 * astar_time, 1000 * new_time,
+            astar_expanded, new_expanded, saved, cost))
+    if total[0]:
+        print('{} expanded {} of the {} nodes of A* ({:.0%} saved)'.format(
+            engine, total[1], total[0], 1 - total[1] / total[0]))
+
+
+def compare_heuristics():
+    '''
+    Compares heur with the 'auto' and 'landmarks' heuristics of the array engine on sloped maps.
+    '''
+    heuristics = ('euclidean', 'auto', 'landmarks')
+    print('{:<12} {:>5} {:>10} {:>10} {:>10} {:>11} {:>11}'.format(
+        'grad', 'maps', 'heur exp.', 'auto exp.', 'ALT exp.', 'heur cost', 'best cost'))
+    for grad in SLOPES:
+        expanded = [0] * len(heuristics)
+        costs = [0] * len(heuristics)
+        count = 0
+        for map_image in maps():
+            env = make_env(map_image, grad)
+            for i, heuristic in enumerate(heuristics):
+                _, path, nodes = run(env, 'array', repeats=1, heuristic=heuristic)
+                expanded[i] += nodes
+                costs[i] += path_cost(env, path) if path else 0
+            assert abs(costs[1] - costs[2]) < 1e-6
+            count += 1
+        print('{:<12} {:>5} {:>10} {:>10} {:>10} {:>11.3f} {:>11.3f}'.format(
+            str(grad), count, expanded[0], expanded[1], expanded[2], costs[0], costs[1]))
+    print('costs are summed over the maps; a heur cost above the best one means heur was not admissible')
+
+
+def random_queries(env, count, seed=0):
+    '''
+    Random (start, goal) pairs of free cells of the maze.
+    '''
+    rng = random.Random(seed)
+    mask = env.get_free_mask()
+    free = [(x, y) for x in range(mask.shape[0]) for y in range(mask.shape[1]) if mask[x, y]]
+    return [(rng.choice(free), rng.choice(free)) for _ in range(count)]
+
+
+def compare_batch():
+    '''
+    Compares Agent.find_paths on a batch of queries with one reset() and one new Agent per query.
+    '''
+    print('{:<16} {:>8} {:>14} {:>14} {:>8}'.format(
+        'map', 'queries', 'single [q/s]', 'batch [q/s]', 'speedup'))
+    for map_image in maps():
+        env = make_env(map_image)
+        queries = random_queries(env, QUERIES)
+        started = time.perf_counter()
+        single = []
+        for query in queries:
+            env.reset()
+            single.extend(Agent(env, engine='array').find_paths([query]))
+        single_rate = QUERIES / (time.perf_counter() - started)
+        agent = Agent(env, engine='array')
+        started = time.perf_counter()
+        paths = agent.find_paths(queries)
+        batch_rate = QUERIES / (time.perf_counter() - started)
+        assert paths == single
+        print('{:<16} {:>8} {:>14.0f} {:>14.0f} {:>8.1f}'.format(
+            os.path.basename(map_image), QUERIES, single_rate, batch_rate, batch_rate / single_rate))
+
+
+def compare_anytime():
+    '''
+    Compares the first path of Agent.find_path_anytime (time, cost, bound),
+    and the time until it proves a path optimal, with array A*.
+    '''
+    print('{:<16} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'map', 'A* [ms]', 'A* cost', 'first [ms]', 'bound', 'cost', 'last [ms]'))
+    for map_image in maps():
+        env = make_env(map_image)
+        best, path, _ = run(env, 'array', heuristic='auto')
+        agent = Agent(env, heuristic='auto')
+        started = time.perf_counter()
+        solutions = agent.find_path_anytime()
+        first = next(solutions)
+        first_time = time.perf_counter() - started
+        for _ in solutions:
+            pass
+        last_time = time.perf_counter() - started
+        print('{:<16} {:>10.2f} {:>10.2f} {:>10.2f} {:>8.3f} {:>10.2f} {:>10.2f}'.format(
+            os.path.basename(map_image), 1000 * best, path_cost(env, path), 1000 * first_time,
+            first.bound, first.cost, 1000 * last_time))
+
+
+def compare_replan():
+    '''
+    Compares DStarLite repairing its search after each round of EDITS
+    random cell edits with a new DStarLite solving the edited maze from scratch.
+    '''
+    print('{:<16} {:>8} {:>14} {:>14} {:>10} {:>10}'.format(
+        'map', 'rounds', 'scratch [ms]', 'repair [ms]', 'scratch N', 'repair N'))
+    rng = random.Random(0)
+    for map_image in maps():
+        env = make_env(map_image)
+        observation = env.reset()
+        start, goal = observation[0][0:2], observation[1][0:2]
+        planner = DStarLite(env, start, goal)
+        planner.find_path()
+        planner.expanded = 0
+        scratch_time = repair_time = 0
+        scratch_expanded = 0
+        edited = []
+        for _ in range(ROUNDS):
+            edits = []
+            while len(edits) < EDITS:
+                x, y = rng.randrange(planner.width), rng.randrange(planner.height)
+                if (x, y) not in (start, goal):
+                    edits.append((x, y, rng.random() < 0.5, rng.random() < 0.2))
+            edited.extend(edits)
+            started = time.perf_counter()
+            planner.edit_cells(edits)
+            repaired = planner.find_path()
+            repair_time += time.perf_counter() - started
+            fresh = DStarLite(env, start, goal)
+            fresh.edit_cells(edited)
+            started = time.perf_counter()
+            path = fresh.find_path()
+            scratch_time += time.perf_counter() - started
+            scratch_expanded += fresh.expanded
+            assert (path is None) == (repaired is None)
+            assert path is None or abs(planner.cost() - fresh.cost()) <= 1e-9 * max(1, abs(fresh.cost())), \
+                'repaired and fresh paths cost differently on ' + map_image
+        print('{:<16} {:>8} {:>14.2f} {:>14.2f} {:>10} {:>10}'.format(
+            os.path.basename(map_image), ROUNDS, 1000 * scratch_time, 1000 * repair_time,
+            scratch_expanded, planner.expanded))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('comparison', nargs='?', default='openlist',
+                        choices=['openlist', 'jps', 'bidirectional', 'heuristic', 'batch', 'anytime', 'replan'])
+    args = parser.parse_args()
+    if args.comparison == 'openlist':
+        compare_open_lists()
+    elif args.comparison == 'heuristic':
+        compare_heuristics()
+    elif args.comparison == 'batch':
+        compare_batch()
+    elif args.comparison == 'anytime':
+        compare_anytime()
+    elif args.comparison == 'replan':
+        compare_replan()
+    elif args.comparison == 'bidirectional':
+        compare_expansions('bidirectional', open_maps())
+    else:
+        compare_expansions('jps')
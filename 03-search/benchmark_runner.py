@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+'''
+Headless benchmark driver: runs Agent.find_path on every map of maps/easy and
+maps/normal, for a sweep of gradients and engines, in a process pool, and
+writes one record per run to CSV and JSON, to track regressions.
+
+  python3 benchmark_runner.py --engines heap array jps --output results
+'''
+
+import argparse
+import csv
+import datetime
+import glob
+import json
+import os
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from agent import Agent
+from benchmark import SLOPES, make_env, path_cost
+
+MAPS = ['maps/easy/*.bmp', 'maps/normal/*.bmp']
+FIELDS = ['map', 'grad_x', 'grad_y', 'engine', 'heuristic', 'found', 'path_length', 'path_cost',
+          'wall_time', 'expanded', 'peak_open']
+
+
+def run_one(task):
+    '''
+    One benchmark run, executed in a worker process.
+    @param task: (map path, grad, engine, heuristic, repeats)
+    @return: dict with the FIELDS of the run, times are the best of the repeats
+    '''
+    map_image, grad, engine, heuristic, repeats = task
+    env = make_env(map_image, grad)
+    agent = Agent(env, engine=engine, heuristic=heuristic)
+    wall_time = float('inf')
+    path = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        path = agent.find_path()
+        wall_time = min(wall_time, time.perf_counter() - started)
+    return {
+        'map': os.path.relpath(map_image, os.path.dirname(os.path.abspath(__file__))),
+        'grad_x': grad[0],
+        'grad_y': grad[1],
+        'engine': engine,
+        'heuristic': heuristic,
+        'found': path is not None,
+        'path_length': len(path) if path else 0,
+        'path_cost': path_cost(env, path) if path else None,
+        'wall_time': wall_time,
+        'expanded': agent.expanded,
+        'peak_open': agent.peak_open,
+    }
+
+
+def tasks(engines, heuristics, grads, repeats):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for pattern in MAPS:
+        for map_image in sorted(glob.glob(os.path.join(here, pattern))):
+            for grad in grads:
+                for engine in engines:
+                    for heuristic in heuristics:
+                        yield (map_image, tuple(grad), engine, heuristic, repeats)
+
+
+def write_results(results, output, settings):
+    '''
+    Writes output.csv (one row per run) and output.json (the runs and the settings they were made with).
+    '''
+    with open(output + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(output + '.json', 'w') as f:
+        json.dump({'settings': settings, 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Runs Agent.find_path over the bundled maps in parallel.')
+    parser.add_argument('--engines', nargs='+', default=['heap'], choices=sorted(Agent.ENGINES))
+    parser.add_argument('--heuristics', nargs='+', default=['euclidean'], choices=Agent.HEURISTICS)
+    parser.add_argument('--grads', nargs='+', default=None, metavar='GX,GY',
+                        help='gradients to sweep, e.g. 0,0 0.3,-0.2 (default: benchmark.SLOPES)')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per record, the best time is kept')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--output', default='benchmark_results', help='path of the results, without extension')
+    args = parser.parse_args()
+
+    grads = SLOPES if args.grads is None else [tuple(float(v) for v in grad.split(',')) for grad in args.grads]
+    todo = list(tasks(args.engines, args.heuristics, grads, args.repeats))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # chunksize keeps the many tiny easy maps from paying one round trip each.
+        results = list(pool.map(run_one, todo, chunksize=max(1, len(todo) // (4 * (os.cpu_count() or 1)))))
+    settings = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'engines': args.engines,
+        'heuristics': args.heuristics,
+        'grads': [list(grad) for grad in grads],
+        'repeats': args.repeats,
+        'elapsed': time.perf_counter() - started,
+    }
+    write_results(results, args.output, settings)
+    print('{} runs in {:.1f} s, written to {}.csv and {}.json'.format(
+        len(results), settings['elapsed'], args.output, args.output))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Bidirectional A* over a SearchGrid.
+"""
+
+import heapq
+import itertools
+
+import numpy as np
+
+from heuristics import heur
+
+
+class BidirectionalAStar:
+    '''
+    Searches forward from the start and backward from the goal at the same
+    time, and stops once the two searches can no longer improve on the best
+    path found where they meet.
+
+    Both searches use the average potential built from the heuristic h,
+    where h(a, b) bounds the cost from a to b (heur by default):
+        p(v) = (h(v, goal) - h(start, v)) / 2
+    forward key g_f(v) + p(v) - p(start), backward key g_b(v) - p(v) + p(goal),
+    both 0 at their root. With these, a move costs the same amount of
+    "reduced cost" seen from either side, so whenever h is consistent, both
+    searches are consistent too: each step expands the side with the lower
+    top key, a node closed by both sides is not expanded again, and the
+    search stops as soon as top_forward + top_backward >= best + p(goal) - p(start),
+    the reduced cost of the best path found.
+
+    As for ARA*, the searches run on the costs without the gradient
+    (search_grid.gradient_offset), for which heur is consistent, and so
+    must be h; with the gradient, heur is not even admissible.
+    '''
+
+    def __init__(self, grid, heuristic=heur):
+        self.grid = grid
+        self.heuristic = heuristic
+        # Backward search walks the moves in reverse: the move k from v
+        # leads to u = v + d_k, and u -> v costs as much as the move k
+        # (same length), plus the hard place surcharge of u.
+        self.steps = [(bit, offset, length) for bit, offset, _, _, _, length in grid.steps]
+        self.parents = np.empty(grid.size, dtype=np.int32)
+        self.g = np.empty(grid.size, dtype=np.float64)
+        self.closed = np.empty(grid.size, dtype=np.uint8)
+        self.expanded = 0
+        self.peak_open = 0
+
+    def find_path(self, start, goal):
+        '''
+        Optimal path from start to goal, both given as (x, y).
+
+        Returns:
+            list: Path as [(x1, y1), (x2, y2)...], or None.
+        '''
+        grid = self.grid
+        source = grid.index(start)
+        target = grid.index(goal)
+        if source == target:
+            return [start]
+        grid.reset_buffers()
+        self.parents.fill(-1)
+        self.g.fill(np.inf)
+        self.closed.fill(0)
+        moves = memoryview(grid.moves)
+        hard = memoryview(grid.hard)
+        width = grid.width
+        heuristic = self.heuristic
+
+        def potential(node):
+            position = (node % width, node // width)
+            return (heuristic(position, goal) - heuristic(start, position)) / 2
+
+        # Each side is (parents, g costs, closed, openList, sign of potential, potential of the root).
+        forward = (memoryview(grid.parents), memoryview(grid.g), memoryview(grid.closed), [], 1, potential(source))
+        backward = (memoryview(self.parents), memoryview(self.g), memoryview(self.closed), [], -1, potential(target))
+        # Reduced cost of a path from start to goal, minus its cost.
+        shift = backward[5] - forward[5]
+        counter = itertools.count()
+        for node, side in ((source, forward), (target, backward)):
+            side[1][node] = 0
+            side[3].append((0, next(counter), 0, node))
+
+        self.expanded = 0
+        self.peak_open = 0
+        best = float('inf')
+        meeting = -1
+        while True:
+            for side in (forward, backward):
+                _, g_cost, closed, openList, _, _ = side
+                # Drop stale entries, so the top is a real candidate.
+                while openList and (closed[openList[0][3]] or openList[0][2] > g_cost[openList[0][3]]):
+                    heapq.heappop(openList)
+            if not forward[3] or not backward[3]:
+                break
+            top_forward = forward[3][0][0]
+            top_backward = backward[3][0][0]
+            if top_forward + top_backward >= best + shift:
+                break
+            if len(forward[3]) + len(backward[3]) > self.peak_open:
+                self.peak_open = len(forward[3]) + len(backward[3])
+            # Expand the side with the lower key.
+            side, other = (forward, backward) if top_forward <= top_backward else (backward, forward)
+            parents, g_cost, closed, openList, sign, root = side
+            other_g = other[1]
+            _, _, g, node = heapq.heappop(openList)
+            closed[node] = 1
+            if other[2][node]:
+                # The other side has settled it, with both g costs final:
+                # best already counts the paths through it.
+                continue
+            self.expanded += 1
+            mask = moves[node]
+            for bit, offset, length in self.steps:
+                if not mask & bit:
+                    continue
+                child = node + offset
+                if closed[child]:
+                    continue
+                # Forward pays the surcharge of the node it leaves,
+                # backward the one of the node it arrives to.
+                newCost = g + (length + hard[node if sign > 0 else child])
+                if g_cost[child] <= newCost:
+                    continue
+                g_cost[child] = newCost
+                parents[child] = node
+                if newCost + other_g[child] < best:
+                    best = newCost + other_g[child]
+                    meeting = child
+                heapq.heappush(openList, (newCost + sign * (potential(child) - root), next(counter), newCost, child))
+
+        if meeting == -1:
+            return None # No path found.
+        path = grid.path_to(meeting)
+        parents = backward[0]
+        node = parents[meeting]
+        while node != -1:
+            path.append(grid.position(node))
+            node = parents[node]
+        return path
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+'''
+Builds a corpus of random benchmark maps: count maps for every (size,
+algorithm, complexity, density) combination, generated in a process pool and
+written in the compiled map format (kuimaze.map_compiler), with a
+manifest.json describing each of them.
+
+Every map has its own seed, made from --seed and the parameters of the map
+(not from the order the workers run in), so the same command always writes
+the same maps, and adding sizes or densities leaves the other maps as they were.
+
+  python3 corpus_builder.py --sizes 50x50 200x100 --algorithms kruskal aisles --densities 0.25 0.75 --count 20 --output corpus
+'''
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from kuimaze import map_compiler, map_generator
+
+#: Where the start and the goals are put. 'corner': the reachable cells nearest to the top left
+#: (start) and bottom right (goals) corners, 'random': random reachable cells, 'farthest' (goals
+#: only): the reachable cells the most moves away from the start.
+START_RULES = ('corner', 'random')
+GOAL_RULES = ('corner', 'random', 'farthest')
+
+
+def map_seed(seed, width, height, algorithm, complexity, density, number):
+    '''
+    Entropy of the numpy.random.SeedSequence of one map.
+    @return: list of ints, stored in the manifest
+    '''
+    return [seed, width, height, map_generator.ALGORITHMS.index(algorithm),
+            int(round(complexity * 1e6)), int(round(density * 1e6)), number]
+
+
+def reachable(walls, start):
+    '''
+    Breadth-first search over the 8 moves of the maze from start (x, y).
+    @return: numpy.ndarray of the number of moves from start, indexed [y, x], -1 where unreachable
+    '''
+    height, width = walls.shape
+    steps = np.full(walls.shape, -1, dtype=np.int64)
+    flat = steps.ravel()
+    free = (~walls).ravel().tolist()
+    source = start[1] * width + start[0]
+    flat[source] = 0
+    queue = collections.deque([source])
+    deltas = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+    while queue:
+        node = queue.popleft()
+        x, y = node % width, node // width
+        for dx, dy in deltas:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                child = ny * width + nx
+                if free[child] and flat[child] < 0:
+                    flat[child] = flat[node] + 1
+                    queue.append(child)
+    return steps
+
+
+def place(walls, rng, start_rule, goal_rule, goals, hard_places):
+    '''
+    Picks the start, the goals and the hard places of the maze.
+    @param hard_places: fraction of the other reachable cells made hard places
+    @return: (start, goals, hard places) as (x, y), or None if less than goals cells can be reached from the start
+    '''
+    ys, xs = np.nonzero(~walls)
+    if not len(xs):
+        return None
+    if start_rule == 'corner':
+        first = np.lexsort((ys, xs + ys))[0]
+    else:
+        first = rng.integers(len(xs))
+    start = (int(xs[first]), int(ys[first]))
+    steps = reachable(walls, start)
+    ys, xs = np.nonzero(steps > 0)
+    if len(xs) < goals:
+        return None
+    if goal_rule == 'corner':
+        order = np.lexsort((-ys, -(xs + ys)))
+    elif goal_rule == 'farthest':
+        order = np.lexsort((rng.random(len(xs)), -steps[ys, xs]))
+    else:
+        order = rng.permutation(len(xs))
+    chosen = order[:goals]
+    rest = order[goals:]
+    hard = rng.choice(rest, size=int(round(hard_places * len(rest))), replace=False) if len(rest) else rest
+    return (start, [(int(xs[i]), int(ys[i])) for i in chosen], [(int(xs[i]), int(ys[i])) for i in sorted(hard)])
+
+
+def build_one(task):
+    '''
+    Generates and writes one map, executed in a worker process.
+    @param task: dict with the parameters of the map, see tasks()
+    @return: manifest record of the map, or None if no valid map could be placed
+    '''
+    rng = np.random.default_rng(np.random.SeedSequence(task['seed']))
+    walls = map_generator.walls(task['width'], task['height'], task['algorithm'], rng,
+                                task['complexity'], task['density'])
+    placed = place(walls, rng, task['start_rule'], task['goal_rule'], task['goals'], task['hard_places'])
+    if placed is None:
+        return None
+    start, goals, hard_places = placed
+    cells = map_compiler.compile_walls(walls, start, goals, hard_places)
+    map_compiler.save(cells, os.path.join(task['output'], task['file']))
+    return {
+        'file': task['file'],
+        'width': walls.shape[1],
+        'height': walls.shape[0],
+        'algorithm': task['algorithm'],
+        'complexity': task['complexity'],
+        'density': task['density'],
+        'seed': task['seed'],
+        'start': list(start),
+        'goals': [list(goal) for goal in goals],
+        'hard_places': len(hard_places),
+        'free': int((~walls).sum()),
+    }
+
+
+def tasks(args):
+    for width, height in args.sizes:
+        for algorithm in args.algorithms:
+            for complexity in args.complexities:
+                for density in args.densities:
+                    for number in range(args.count):
+                        name = '{}x{}_{}_c{:g}_d{:g}_{:04d}'.format(width, height, algorithm, complexity, density, number)
+                        yield {
+                            'width': width, 'height': height, 'algorithm': algorithm,
+                            'complexity': complexity, 'density': density,
+                            'seed': map_seed(args.seed, width, height, algorithm, complexity, density, number),
+                            'start_rule': args.start, 'goal_rule': args.goal, 'goals': args.goals,
+                            'hard_places': args.hard_places,
+                            'output': args.output, 'file': name + map_compiler.SUFFIX,
+                        }
+
+
+def size(text):
+    width, _, height = text.partition('x')
+    return (int(width), int(height or width))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generates a reproducible corpus of compiled benchmark maps.')
+    parser.add_argument('--sizes', nargs='+', type=size, default=[(50, 50)], metavar='WxH')
+    parser.add_argument('--algorithms', nargs='+', default=['kruskal'], choices=map_generator.ALGORITHMS,
+                        help="'aisles' is slow on large maps (minutes for 401x401, "
+                             "against a fraction of a second for 'kruskal' and 'division')")
+    parser.add_argument('--complexities', nargs='+', type=float, default=[0.75], help="only used by 'aisles'")
+    parser.add_argument('--densities', nargs='+', type=float, default=[0.75], help="only used by 'aisles'")
+    parser.add_argument('--count', type=int, default=10, help='maps per combination of the parameters above')
+    parser.add_argument('--seed', type=int, default=0, help='base seed of the corpus')
+    parser.add_argument('--start', default='corner', choices=START_RULES)
+    parser.add_argument('--goal', default='corner', choices=GOAL_RULES)
+    parser.add_argument('--goals', type=int, default=1, help='goals per map')
+    parser.add_argument('--hard-places', type=float, default=0.0,
+                        help='fraction of the reachable cells (but the start and the goals) made hard places')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--output', default='corpus', help='directory of the maps and manifest.json')
+    args = parser.parse_args()
+    assert 0 <= args.hard_places <= 1
+
+    os.makedirs(args.output, exist_ok=True)
+    todo = list(tasks(args))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        records = list(pool.map(build_one, todo, chunksize=max(1, len(todo) // (4 * (os.cpu_count() or 1)))))
+    skipped = [task['file'] for task, record in zip(todo, records) if record is None]
+    settings = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'format_version': map_compiler.FORMAT_VERSION,
+        'seed': args.seed,
+        'sizes': [list(wh) for wh in args.sizes],
+        'algorithms': args.algorithms,
+        'complexities': args.complexities,
+        'densities': args.densities,
+        'count': args.count,
+        'start': args.start,
+        'goal': args.goal,
+        'goals': args.goals,
+        'hard_places': args.hard_places,
+        'elapsed': time.perf_counter() - started,
+    }
+    with open(os.path.join(args.output, 'manifest.json'), 'w') as f:
+        json.dump({'settings': settings, 'maps': [record for record in records if record is not None],
+                   'skipped': skipped}, f, indent=1)
+    print('{} maps in {:.1f} s ({} skipped), written to {}'.format(
+        len(todo) - len(skipped), settings['elapsed'], len(skipped), args.output))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Distance fields: the cost of the cheapest path to one goal from every cell,
+from which the path from any start is read off without a search.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from search_grid import dijkstra, gradient_offset
+
+#: Number of fields kept in memory by get_field.
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+
+
+class DistanceField:
+    '''
+    Reverse Dijkstra from the goal over the whole maze.
+
+    The field is computed without the gradient, which distance() adds back
+    (search_grid.gradient_offset), so it serves every grad of the map.
+    '''
+
+    def __init__(self, grid, goal):
+        self.grid = grid
+        self.goal = (goal[0], goal[1])
+        self.target = grid.index(goal)
+        #: Costs to the goal without the gradient, indexed by y*W + x.
+        self.field = dijkstra(grid, self.target, reverse=True)
+        self._steps = [(bit, offset, length) for bit, offset, _, _, _, length in grid.steps]
+
+    def distance(self, position, grad=(0, 0)):
+        '''
+        Cost of the cheapest path from position to the goal, inf if there is none.
+        '''
+        d = self.field[self.grid.index(position)]
+        return float(d) + gradient_offset(grad, position, self.goal)
+
+    def to_array(self, grad=(0, 0)):
+        '''
+        The whole field for the gradient, indexed [x, y] like Maze.get_free_mask.
+        '''
+        xs, ys = np.meshgrid(np.arange(self.grid.width), np.arange(self.grid.height))
+        field = self.field.reshape(self.grid.height, self.grid.width)
+        return (field + gradient_offset(grad, (xs, ys), self.goal)).T
+
+    def path_from(self, start):
+        '''
+        Cheapest path from start to the goal, by always stepping to the
+        neighbour that has the lowest move cost plus distance. O(path length).
+
+        Returns:
+            list: Path as [(x1, y1), (x2, y2)...], or None if the goal cannot be reached.
+        '''
+        grid = self.grid
+        field = memoryview(self.field)
+        moves = memoryview(grid.moves)
+        node = grid.index(start)
+        if field[node] == float('inf'):
+            return None
+        path = [grid.position(node)]
+        while node != self.target:
+            # Every move costs at least 1 here, so the distance strictly
+            # decreases, and the walk cannot loop.
+            mask = moves[node]
+            best = float('inf')
+            best_child = -1
+            for bit, offset, length in self._steps:
+                if mask & bit and length + field[node + offset] < best:
+                    best = length + field[node + offset]
+                    best_child = node + offset
+            node = best_child
+            path.append(grid.position(node))
+        return path
+
+
+def get_field(grid, goal):
+    '''
+    Returns the DistanceField of the goal on the map of the grid, computed
+    on the first request and then kept in memory (the CACHE_SIZE most
+    recently used ones). The key is the map (walls and hard places) and
+    the goal; the gradient is not needed, see DistanceField.
+    '''
+    key = (grid.digest(), goal[0], goal[1])
+    field = _cache.get(key)
+    if field is None:
+        field = DistanceField(grid, goal)
+        _cache[key] = field
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    _cache.move_to_end(key)
+    return field
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+D* Lite (Koenig & Likhachev, 2002): incremental replanning when cells of
+the maze change between queries.
+"""
+
+import collections
+import heapq
+from math import sqrt
+
+from heuristics import HARD_PLACE_COST, octile
+from search_grid import gradient_offset
+
+INF = float('inf')
+#: Keys whose first values are this close are taken as equal by the stop
+#: test of compute: the same sum of moves rounds differently in the keys
+#: of different nodes.
+KEY_TOLERANCE = 1e-9
+
+#: New state of one cell: wall or not, hard place or not.
+CellEdit = collections.namedtuple('CellEdit', ['x', 'y', 'wall', 'hard'])
+
+
+class DStarLite:
+    '''
+    Keeps the search of the last query, and repairs only the part of it
+    that the edited cells invalidate.
+
+    The search runs backward from the goal, so the start may also move
+    (move_start) without losing it. g(s) is the cost from s to the goal.
+
+    The search runs on the costs without the gradient, which cost() adds
+    back (search_grid.gradient_offset).
+
+    The planner owns its copy of the occupancy: edits change the planner,
+    not the Maze of the environment.
+    '''
+
+    def __init__(self, environment, start, goal):
+        mask = environment.get_free_mask()
+        self.width, self.height = mask.shape
+        self.grad = environment.get_grad()
+        self.deltas = [(dx, dy, sqrt(dx * dx + dy * dy)) for dx, dy in environment.get_deltas()]
+        size = self.width * self.height
+        self.free = bytearray(size)
+        for x in range(self.width):
+            for y in range(self.height):
+                if mask[x, y]:
+                    self.free[y * self.width + x] = 1
+        self.hard = bytearray(size)
+        for place in environment.get_hard_places():
+            self.hard[place[1] * self.width + place[0]] = 1
+        self.start = self._index(start)
+        self.goal = self._index(goal)
+        self.expanded = 0
+        self._restart()
+
+    def _restart(self):
+        # Drops the search, the next compute searches from scratch.
+        size = self.width * self.height
+        self.g = [INF] * size
+        self.rhs = [INF] * size
+        self.last = self.start
+        self.km = 0
+        self.openList = []
+        self.inOpen = {} # node -> its current key, entries with another key are stale
+        self.rhs[self.goal] = 0
+        self._push(self.goal)
+
+    def _index(self, position):
+        return position[1] * self.width + position[0]
+
+    def _position(self, index):
+        return (index % self.width, index // self.width)
+
+    def _neighbours(self, node):
+        '''
+        Yields (neighbour, move length) for all cells around node, walls included.
+        '''
+        x, y = node % self.width, node // self.width
+        for dx, dy, length in self.deltas:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                yield ny * self.width + nx, length
+
+    def _cost(self, node, child, length):
+        if not self.free[node] or not self.free[child]:
+            return INF
+        return length + HARD_PLACE_COST * self.hard[node]
+
+    def _key(self, node):
+        g = min(self.g[node], self.rhs[node])
+        return (g + octile(self._position(self.start), self._position(node)) + self.km, g)
+
+    def _push(self, node):
+        key = self._key(node)
+        self.inOpen[node] = key
+        heapq.heappush(self.openList, (key, node))
+
+    def _update(self, node):
+        if node != self.goal:
+            best = INF
+            for child, length in self._neighbours(node):
+                cost = self._cost(node, child, length) + self.g[child]
+                if cost < best:
+                    best = cost
+            self.rhs[node] = best
+        self.inOpen.pop(node, None)
+        if self.g[node] != self.rhs[node]:
+            self._push(node)
+
+    def _top(self):
+        # Drops stale entries, returns the top (key, node) or None.
+        while self.openList:
+            key, node = self.openList[0]
+            if self.inOpen.get(node) == key:
+                return key, node
+            heapq.heappop(self.openList)
+        return None
+
+    def compute(self):
+        '''
+        Brings g up to date for the current start. Returns the number of
+        nodes it expanded, which is also added to self.expanded.
+        '''
+        expanded = 0
+        while True:
+            top = self._top()
+            start = self.start
+            if top is None:
+                break
+            # Stop once the top key is above the key of the start. A node
+            # whose key only ties with it up to the rounding may still lower
+            # or raise g of the start, so those are expanded too.
+            if top[0][0] > self._key(start)[0] + KEY_TOLERANCE and self.rhs[start] == self.g[start]:
+                break
+            key, node = top
+            heapq.heappop(self.openList)
+            del self.inOpen[node]
+            expanded += 1
+            new_key = self._key(node)
+            if key < new_key:
+                self.inOpen[node] = new_key
+                heapq.heappush(self.openList, (new_key, node))
+            elif self.g[node] > self.rhs[node]:
+                self.g[node] = self.rhs[node]
+                for parent, _ in self._neighbours(node):
+                    self._update(parent)
+            else:
+                self.g[node] = INF
+                self._update(node)
+                for parent, _ in self._neighbours(node):
+                    self._update(parent)
+        self.expanded += expanded
+        return expanded
+
+    def edit_cells(self, edits):
+        '''
+        Applies a batch of CellEdit (or (x, y, wall, hard) tuples) and
+        marks the affected nodes for repair. Call find_path afterwards.
+        '''
+        for x, y, wall, hard in edits:
+            node = y * self.width + x
+            if self.free[node] == (not wall) and self.hard[node] == bool(hard):
+                continue # Nothing changes.
+            self.free[node] = not wall
+            self.hard[node] = bool(hard)
+            # The moves out of node and into node change, so node and all
+            # its neighbours have to recompute rhs.
+            self._update(node)
+            for parent, _ in self._neighbours(node):
+                self._update(parent)
+
+    def move_start(self, start):
+        '''
+        Moves the start (the agent walked along the path), keeping the search.
+        '''
+        start = self._index(start)
+        self.km += octile(self._position(self.last), self._position(start))
+        self.last = start
+        self.start = start
+
+    def find_path(self):
+        '''
+        Repairs the search and returns the path from the start to the goal
+        as [(x1, y1), (x2, y2)...], or None if there is none.
+        '''
+        self.compute()
+        path = self._walk()
+        if path is None and self.g[self.start] != INF:
+            # The repaired g led the walk astray, search again from scratch.
+            self._restart()
+            self.compute()
+            path = self._walk()
+        return path
+
+    def _walk(self):
+        '''
+        Follows the moves that give rhs, the lowest move cost plus g, from
+        the start. Returns None if the goal cannot be reached, or if the
+        walk hits a dead end or a cell it already went through.
+        '''
+        node = self.start
+        if self.g[node] == INF:
+            return None
+        path = [self._position(node)]
+        visited = {node}
+        while node != self.goal:
+            best = INF
+            best_child = -1
+            for child, length in self._neighbours(node):
+                cost = self._cost(node, child, length) + self.g[child]
+                if cost < best:
+                    best = cost
+                    best_child = child
+            if best_child == -1 or best_child in visited:
+                return None
+            node = best_child
+            visited.add(node)
+            path.append(self._position(node))
+        return path
+
+    def cost(self):
+        '''
+        Cost of the current path, with the gradient, as summed by expand.
+        '''
+        self.compute()
+        return self.g[self.start] + gradient_offset(self.grad, self._position(self.start), self._position(self.goal))
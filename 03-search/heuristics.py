@@ -6,8 +6,109 @@ Created on Sun Mar  8 16:30:15 2020
 """
 
 from math import sqrt
+
+#: Extra cost of leaving a hard place, see EasyMazeEnv._get_cost.
+HARD_PLACE_COST = 5
+
+
 def heur(first, second):
     '''
     Returns Euclidean distance between two points as tuples.
     '''
-    return sqrt((first[0] - second[0])**2 + (first[1] - second[1])**2)
\ No newline at end of file
+    return sqrt((first[0] - second[0])**2 + (first[1] - second[1])**2)
+
+
+def octile(first, second):
+    '''
+    Returns octile distance between two points as tuples: the length of the
+    shortest path with 8 moves of length 1 and sqrt(2), ignoring walls.
+    '''
+    dx = abs(first[0] - second[0])
+    dy = abs(first[1] - second[1])
+    return max(dx, dy) + (sqrt(2) - 1) * min(dx, dy)
+
+
+class GradientHeuristic:
+    '''
+    Lower bound of the cost from first to second in a tilted maze.
+    
+    A move d from u costs |d| - grad . d (+5 if u is a hard place).
+    Along any path the gradient terms add up to -grad . (second - first),
+    whatever the path is, and the lengths add up to at least the octile
+    distance. So octile - grad . (second - first) is admissible and
+    consistent, and exact on an empty maze. Euclidean distance alone is
+    not admissible going downhill, and loose going uphill.
+    '''
+    def __init__(self, grad, hard_places=()):
+        self.grad = (grad[0], grad[1])
+        self.hard_places = frozenset((place[0], place[1]) for place in hard_places)
+
+    def __call__(self, first, second):
+        h = octile(first, second) - (self.grad[0] * (second[0] - first[0]) +
+                                     self.grad[1] * (second[1] - first[1]))
+        if self.hard_places and (first[0], first[1]) in self.hard_places \
+                and (first[0], first[1]) != (second[0], second[1]):
+            h += HARD_PLACE_COST # Leaving first costs this much, whatever the move.
+        return h
+
+
+def select_heuristic(environment):
+    '''
+    Returns the tightest admissible heuristic for the costs of the
+    environment: octile on a flat maze, GradientHeuristic otherwise.
+    '''
+    grad = environment.get_grad()
+    hard_places = environment.get_hard_places()
+    if grad[0] == 0 and grad[1] == 0 and not hard_places:
+        return octile
+    return GradientHeuristic(grad, hard_places)
+
+
+class GoalIndex:
+    '''
+    2-d tree of goal positions. distance() returns the Euclidean distance to
+    the nearest goal in O(log G) on average, instead of checking all G goals.
+    min over admissible heuristics is admissible, so it can be used to
+    search for the nearest of many goals at once.
+    '''
+    def __init__(self, goals):
+        self.size = len(goals)
+        self.root = self._build([tuple(goal[0:2]) for goal in goals], 0)
+
+    def _build(self, points, axis):
+        # Node: (point, axis, left subtree, right subtree)
+        if not points:
+            return None
+        points.sort(key=lambda point: point[axis])
+        middle = len(points) // 2
+        return (points[middle], axis,
+                self._build(points[:middle], 1 - axis),
+                self._build(points[middle + 1:], 1 - axis))
+
+    def nearest(self, position):
+        '''
+        Returns (distance, goal) of the goal nearest to position.
+        '''
+        best = (float('inf'), None)
+        # Stack of (subtree, lower bound of the distance to any of its goals)
+        stack = [(self.root, 0)]
+        while stack:
+            node, bound = stack.pop()
+            if node is None or bound >= best[0]:
+                continue
+            point, axis, left, right = node
+            distance = heur(position, point)
+            if distance < best[0]:
+                best = (distance, point)
+            diff = position[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Goals on the far side are at least as far as the splitting line.
+            stack.append((far, max(bound, abs(diff))))
+            stack.append((near, bound))
+        return best
+
+    def distance(self, position):
+        '''
+        Euclidean distance from position to the nearest goal.
+        '''
+        return self.nearest(position)[0]
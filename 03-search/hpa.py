@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Hierarchical path-finding A* (HPA*, Botea, Müller & Schaeffer, 2004) over
+a SearchGrid: the maze is cut into square clusters, A* runs on the graph
+of cluster entrances, and the path is filled in cluster by cluster.
+"""
+
+import heapq
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+from heuristics import octile
+
+#: Side of the square clusters, in cells.
+CLUSTER_SIZE = 16
+#: Entrances at least this wide get a transition at both ends and in the
+#: middle, narrower ones a single one in the middle.
+WIDE_ENTRANCE = 6
+#: The refined path is searched again in pieces of this many cells, each
+#: within its bounding box widened by SMOOTHING_MARGIN cells.
+SMOOTHING_WINDOW = 2 * CLUSTER_SIZE
+SMOOTHING_MARGIN = 4
+#: Number of abstractions kept in memory by get_abstraction.
+CACHE_SIZE = 16
+
+_cache = OrderedDict()
+
+
+class Abstraction:
+    '''
+    The abstract graph of one map.
+
+    Its nodes are the cells at both ends of the chosen transitions between
+    neighbouring clusters. Edges are the transitions themselves (one move)
+    and, inside each cluster, the cost of the cheapest path between every
+    two of its nodes that stays in the cluster.
+
+    The costs are without the gradient (search_grid.gradient_offset), so
+    one abstraction serves every grad.
+
+    Paths are near-optimal, not optimal: they cross between clusters only
+    at the transitions. The detours that makes are mostly taken out again
+    by _smooth, but a better path that leaves the bounding box of a piece
+    by more than SMOOTHING_MARGIN is not found.
+    '''
+
+    def __init__(self, grid, cluster_size=CLUSTER_SIZE, previous=None):
+        self.grid = grid
+        self.digest = grid.digest()
+        self.size = cluster_size
+        self.columns = -(-grid.width // cluster_size)
+        self.rows = -(-grid.height // cluster_size)
+        self._steps = [(bit, offset, length, dx, dy) for bit, offset, _, dx, dy, length in grid.steps]
+        self._moves = memoryview(grid.moves)
+        self._hard = memoryview(grid.hard)
+        # The moves that stay in the cluster of the cell, for the searches inside a cluster.
+        xs = np.arange(grid.width)
+        ys = np.arange(grid.height)
+        inner = np.zeros((grid.height, grid.width), dtype=np.uint8)
+        for bit, _, _, dx, dy, _ in grid.steps:
+            same = ((ys + dy) // cluster_size == ys // cluster_size)[:, None] & \
+                   ((xs + dx) // cluster_size == xs // cluster_size)[None, :]
+            inner |= np.where(same, bit, 0).astype(np.uint8)
+        inner = grid.moves & inner.ravel()
+        self._inner = memoryview(inner)
+        self._inner_grid = inner.reshape(grid.height, grid.width)
+        self.expanded = 0
+        clusters = range(self.columns * self.rows)
+        self.signatures = [self._signature(cluster) for cluster in clusters]
+        if previous is not None and (previous.size, previous.columns, previous.rows, previous.grid.width) == \
+                (cluster_size, self.columns, self.rows, grid.width):
+            # Same layout: keep everything of the clusters the edits did not touch.
+            changed = {cluster for cluster in clusters
+                       if self.signatures[cluster] != previous.signatures[cluster]}
+            self.transitions = {pair: crossings for pair, crossings in previous.transitions.items()
+                                if pair[0] not in changed and pair[1] not in changed}
+            self.intra = list(previous.intra)
+        else:
+            changed = set(clusters)
+            self.transitions = {}
+            self.intra = [None] * len(clusters)
+        #: Number of clusters rebuilt for this abstraction.
+        self.rebuilt = len(changed)
+        self._find_transitions(changed)
+        self.nodes = [set() for _ in clusters]
+        self.inter = {}
+        for crossings in self.transitions.values():
+            for first, second, length in crossings:
+                self.nodes[self.cluster(first)].add(first)
+                self.nodes[self.cluster(second)].add(second)
+                self.inter.setdefault(first, []).append((second, length + self._hard[first]))
+                self.inter.setdefault(second, []).append((first, length + self._hard[second]))
+        for cluster in clusters:
+            if cluster in changed or self.intra[cluster] is None or set(self.intra[cluster]) != self.nodes[cluster]:
+                self.intra[cluster] = self._connect(cluster)
+
+    def cluster(self, index):
+        '''
+        Number of the cluster of the flat index.
+        '''
+        return (index // self.grid.width // self.size) * self.columns + (index % self.grid.width) // self.size
+
+    def _bounds(self, cluster):
+        x0 = (cluster % self.columns) * self.size
+        y0 = (cluster // self.columns) * self.size
+        return x0, y0, min(x0 + self.size, self.grid.width), min(y0 + self.size, self.grid.height)
+
+    def _signature(self, cluster):
+        # The moves and hard places of the cells of the cluster. The moves
+        # of its border cells also tell which neighbouring cells are free.
+        x0, y0, x1, y1 = self._bounds(cluster)
+        width = self.grid.width
+        return b''.join(bytes(self.grid.moves[y * width + x0:y * width + x1]) +
+                        bytes(self.grid.hard[y * width + x0:y * width + x1]) for y in range(y0, y1))
+
+    def _find_transitions(self, changed):
+        '''
+        Picks the transitions between every changed cluster and its neighbours.
+
+        All moves from one cluster to the other are grouped into entrances,
+        runs of moves whose ends are next to each other on both sides. The
+        cells of a run are connected along the border, so one transition
+        per run (two for wide runs) keeps the abstract graph connected
+        wherever the maze is.
+        '''
+        width = self.grid.width
+        crossings = {}
+        for cluster in changed:
+            x0, y0, x1, y1 = self._bounds(cluster)
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    if x0 < x < x1 - 1 and y0 < y < y1 - 1:
+                        continue # Not on the border of the cluster.
+                    node = y * width + x
+                    mask = self._moves[node]
+                    for bit, offset, length, dx, dy in self._steps:
+                        if not mask & bit:
+                            continue
+                        other = self.cluster(node + offset)
+                        if other == cluster:
+                            continue
+                        # Each move is found from both sides, keep it once.
+                        pair = (min(cluster, other), max(cluster, other))
+                        first, second = (node, node + offset) if cluster < other else (node + offset, node)
+                        crossings.setdefault(pair, set()).add((first, second, length))
+        for pair, moves in crossings.items():
+            self.transitions[pair] = self._entrances(pair, sorted(moves, key=lambda move: self._along(pair, move)))
+
+    def _along(self, pair, move):
+        # Position of both ends of a move along the border of the pair.
+        width = self.grid.width
+        if pair[0] // self.columns == pair[1] // self.columns: # Side by side, the border is vertical.
+            return (move[0] // width, move[1] // width)
+        return (move[0] % width, move[1] % width)
+
+    def _entrances(self, pair, moves):
+        runs = [[moves[0]]]
+        for move in moves[1:]:
+            last = self._along(pair, runs[-1][-1])
+            here = self._along(pair, move)
+            if abs(here[0] - last[0]) <= 1 and abs(here[1] - last[1]) <= 1:
+                runs[-1].append(move)
+            else:
+                runs.append([move])
+        chosen = []
+        for run in runs:
+            if self._along(pair, run[-1])[0] - self._along(pair, run[0])[0] + 1 >= WIDE_ENTRANCE:
+                chosen.extend([run[0], run[len(run) // 2], run[-1]])
+            else:
+                # The straight move nearest to the middle, diagonals only if there is none.
+                middle = len(run) // 2
+                chosen.append(min(run, key=lambda move: (move[2], abs(run.index(move) - middle))))
+        return chosen
+
+    def _local(self, source, reverse=False, targets=()):
+        '''
+        Dijkstra from source over the cells of its cluster only (to source,
+        if reverse). Stops once all targets are closed, if there are any.
+
+        Returns:
+            (costs, parents): dicts of the flat indices reached.
+        '''
+        inner = self._inner
+        hard = self._hard
+        costs = {source: 0}
+        parents = {source: -1}
+        closed = set()
+        remaining = len(targets)
+        openList = [(0, source)]
+        while openList:
+            d, node = heapq.heappop(openList)
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            if node in targets:
+                remaining -= 1
+                if not remaining:
+                    break
+            mask = inner[node]
+            for bit, offset, length, _, _ in self._steps:
+                if not mask & bit:
+                    continue
+                child = node + offset
+                # Walking backward, child -> node is the move, and child pays.
+                newCost = d + length + hard[child if reverse else node]
+                if newCost < costs.get(child, float('inf')):
+                    costs[child] = newCost
+                    parents[child] = node
+                    heapq.heappush(openList, (newCost, child))
+        return costs, parents
+
+    def _connect(self, cluster):
+        '''
+        Costs between all nodes of the cluster, staying in the cluster.
+
+        Instead of one Dijkstra per node, the costs from all the nodes are
+        relaxed together as a (nodes, rows, columns) array: each pass takes
+        every move of the cluster at once, for every node, and the passes
+        repeat until no cost goes down any more (Bellman-Ford, with the
+        moves as whole-array shifts).
+
+        Returns:
+            dict: node -> [(other node of the cluster, cost)] for every reachable pair.
+        '''
+        nodes = sorted(self.nodes[cluster])
+        if len(nodes) < 2:
+            return {node: [] for node in nodes}
+        width = self.grid.width
+        x0, y0, x1, y1 = self._bounds(cluster)
+        moves = self._inner_grid[y0:y1, x0:x1]
+        hard = self.grid.hard.reshape(self.grid.height, width)[y0:y1, x0:x1]
+        rows, columns = moves.shape
+        # Cost of each move from each cell, inf where the move is not possible.
+        shifts = []
+        for bit, _, length, dx, dy in self._steps:
+            cost = np.where(moves & bit, length + hard, np.inf)
+            source = (slice(max(0, -dy), rows - max(0, dy)), slice(max(0, -dx), columns - max(0, dx)))
+            target = (slice(max(0, dy), rows + min(0, dy)), slice(max(0, dx), columns + min(0, dx)))
+            shifts.append(((slice(None),) + source, (slice(None),) + target, cost[source]))
+        costs = np.full((len(nodes), rows, columns), np.inf)
+        ys = [node // width - y0 for node in nodes]
+        xs = [node % width - x0 for node in nodes]
+        costs[np.arange(len(nodes)), ys, xs] = 0
+        previous = None
+        while previous is None or not np.array_equal(previous, costs):
+            previous = costs.copy()
+            for source, target, cost in shifts:
+                np.minimum(costs[target], costs[source] + cost, out=costs[target])
+        found = costs[:, ys, xs].tolist()
+        return {node: [(other, found[i][j]) for j, other in enumerate(nodes) if j != i and found[i][j] < np.inf]
+                for i, node in enumerate(nodes)}
+
+    def find_path(self, start, goal):
+        '''
+        Near-optimal path from start to goal, both (x, y).
+
+        The abstract search runs now; the path inside each cluster is only
+        searched when the generator gets there.
+
+        Returns:
+            generator: (x, y) from start to goal, or None if there is no path.
+        '''
+        width = self.grid.width
+        source = start[1] * width + start[0]
+        target = goal[1] * width + goal[0]
+        self.expanded = 0
+        if not self._moves[source] and source != target:
+            return None
+        start_cluster = self.cluster(source)
+        goal_cluster = self.cluster(target)
+        from_start, _ = self._local(source)
+        to_goal, _ = self._local(target, reverse=True)
+        goal_xy = (goal[0], goal[1])
+
+        def neighbours(node):
+            if node == source:
+                for other in self.nodes[start_cluster]:
+                    if other in from_start:
+                        yield other, from_start[other]
+                if goal_cluster == start_cluster and target in from_start:
+                    yield target, from_start[target]
+            elif node in self.nodes[self.cluster(node)]:
+                yield from self.intra[self.cluster(node)][node]
+            if node in self.inter:
+                yield from self.inter[node]
+            if node in to_goal and node != target:
+                yield target, to_goal[node]
+
+        counter = itertools.count()
+        parents = {source: -1}
+        best_g = {source: 0}
+        closed = set()
+        openList = [(octile(start, goal_xy), next(counter), 0, source)]
+        while openList:
+            f, _, g, node = heapq.heappop(openList)
+            if node in closed or g > best_g[node]:
+                continue # Stale entry.
+            closed.add(node)
+            self.expanded += 1
+            if node == target:
+                abstract = [node]
+                while parents[node] != -1:
+                    node = parents[node]
+                    abstract.append(node)
+                return self._smooth(self._refine(abstract[::-1]))
+            for child, cost in neighbours(node):
+                newCost = g + cost
+                if child in closed or best_g.get(child, float('inf')) <= newCost:
+                    continue
+                best_g[child] = newCost
+                parents[child] = node
+                heapq.heappush(openList, (newCost + octile((child % width, child // width), goal_xy),
+                                          next(counter), newCost, child))
+        return None # No path found.
+
+    def _refine(self, abstract):
+        '''
+        Generator of the cells of the abstract path: transitions are single
+        moves, every other edge is searched inside its cluster.
+        '''
+        width = self.grid.width
+        yield (abstract[0] % width, abstract[0] // width)
+        for node, next_node in zip(abstract, abstract[1:]):
+            if self.cluster(node) != self.cluster(next_node):
+                yield (next_node % width, next_node // width)
+                continue
+            _, parents = self._local(node, targets={next_node})
+            segment = []
+            cell = next_node
+            while cell != node:
+                segment.append(cell)
+                cell = parents[cell]
+            for cell in reversed(segment):
+                yield (cell % width, cell // width)
+
+    def _smooth(self, cells):
+        '''
+        Generator of a path between the ends of cells that costs no more:
+        every SMOOTHING_WINDOW cells, the piece is replaced by the cheapest
+        path within its box (see _window), whose first half is given out,
+        and the next piece starts in its middle. Each cheapest path is at
+        most as expensive as the piece, which is one of the paths in the
+        box, so the whole path is too. Reads cells only as far as needed.
+        '''
+        piece = []
+        for cell in cells:
+            piece.append(cell)
+            if len(piece) > SMOOTHING_WINDOW:
+                better = self._window(piece)
+                middle = len(better) // 2
+                yield from better[:middle]
+                piece = better[middle:]
+        yield from self._window(piece) if len(piece) > 2 else piece
+
+    def _window(self, piece):
+        '''
+        A* from the first to the last cell of piece, over the cells of its
+        bounding box widened by SMOOTHING_MARGIN.
+
+        Returns:
+            list: (x, y) of the cheapest path in the box.
+        '''
+        width = self.grid.width
+        moves = self._moves
+        hard = self._hard
+        xs = [x for x, _ in piece]
+        ys = [y for _, y in piece]
+        x0, x1 = max(0, min(xs) - SMOOTHING_MARGIN), min(width - 1, max(xs) + SMOOTHING_MARGIN)
+        y0, y1 = max(0, min(ys) - SMOOTHING_MARGIN), min(self.grid.height - 1, max(ys) + SMOOTHING_MARGIN)
+        goal = piece[-1]
+        source = piece[0][1] * width + piece[0][0]
+        target = goal[1] * width + goal[0]
+        costs = {source: 0}
+        parents = {source: -1}
+        closed = set()
+        openList = [(octile(piece[0], goal), 0, source)]
+        while openList:
+            f, g, node = heapq.heappop(openList)
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            if node == target:
+                break
+            mask = moves[node]
+            addition = hard[node]
+            x, y = node % width, node // width
+            for bit, offset, length, dx, dy in self._steps:
+                if not mask & bit or not (x0 <= x + dx <= x1 and y0 <= y + dy <= y1):
+                    continue
+                child = node + offset
+                newCost = g + (length + addition)
+                if newCost < costs.get(child, float('inf')):
+                    costs[child] = newCost
+                    parents[child] = node
+                    heapq.heappush(openList, (newCost + octile((x + dx, y + dy), goal), newCost, child))
+        path = []
+        node = target
+        while node != -1:
+            path.append((node % width, node // width))
+            node = parents[node]
+        return path[::-1]
+
+
+def get_abstraction(grid, cluster_size=CLUSTER_SIZE, previous=None):
+    '''
+    Returns the Abstraction of the map of the grid, built on the first
+    request and then kept in memory (the CACHE_SIZE most recently used).
+
+    If the map changed since previous (an Abstraction of the same maze
+    before the edits), only the clusters whose cells changed are rebuilt.
+    '''
+    key = (grid.digest(), cluster_size)
+    abstraction = _cache.get(key)
+    if abstraction is None:
+        abstraction = Abstraction(grid, cluster_size, previous)
+        _cache[key] = abstraction
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    _cache.move_to_end(key)
+    return abstraction
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Jump Point Search (Harabor & Grastien, 2011) over a SearchGrid.
+
+Only valid when all moves cost their length (1 or sqrt(2)), i.e. the maze
+has no gradient and no hard places. Diagonal moves may cut corners, the
+same as in EasyMazeEnv.expand.
+"""
+
+import heapq
+import itertools
+
+from heuristics import heur
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+class JumpPointSearch:
+    '''
+    JPS planner bound to one SearchGrid.
+
+    Every check JPS needs ("is the cell next to me free?") is a bit of the
+    move mask of the current cell, so the planner works only on grid.moves.
+    '''
+
+    def __init__(self, grid, heuristic=heur):
+        self.grid = grid
+        self.heuristic = heuristic
+        # (dx, dy) -> (bit, index offset, cost of one step)
+        self.steps = {(dx, dy): (bit, offset, base) for bit, offset, base, dx, dy, _ in grid.steps}
+        self.forced = {}
+        self.natural = {}
+        for dx, dy in self.steps:
+            # forced[d] is a list of (blocked bit, direction): if the move
+            # along blocked is not possible, direction has to be explored.
+            if dx and dy:
+                self.natural[dx, dy] = [(dx, 0), (0, dy), (dx, dy)]
+                self.forced[dx, dy] = [(self.steps[-dx, 0][0], (-dx, dy)),
+                                       (self.steps[0, -dy][0], (dx, -dy))]
+            elif dx:
+                self.natural[dx, dy] = [(dx, 0)]
+                self.forced[dx, dy] = [(self.steps[0, 1][0], (dx, 1)),
+                                       (self.steps[0, -1][0], (dx, -1))]
+            else:
+                self.natural[dx, dy] = [(0, dy)]
+                self.forced[dx, dy] = [(self.steps[1, 0][0], (1, dy)),
+                                       (self.steps[-1, 0][0], (-1, dy))]
+        self.expanded = 0
+        self.peak_open = 0
+
+    def _has_forced(self, mask, direction):
+        for blocked, forced in self.forced[direction]:
+            if not mask & blocked and mask & self.steps[forced][0]:
+                return True
+        return False
+
+    def _jump(self, moves, node, direction, target):
+        '''
+        Moves from node along direction until it reaches a jump point.
+        Returns (jump point, number of steps), or (-1, 0) when it hits a wall.
+        '''
+        bit, offset, _ = self.steps[direction]
+        dx, dy = direction
+        diagonal = dx and dy
+        steps = 0
+        while moves[node] & bit:
+            node += offset
+            steps += 1
+            if node == target:
+                return node, steps
+            if self._has_forced(moves[node], direction):
+                return node, steps
+            if diagonal:
+                if self._jump(moves, node, (dx, 0), target)[0] != -1:
+                    return node, steps
+                if self._jump(moves, node, (0, dy), target)[0] != -1:
+                    return node, steps
+        return -1, 0
+
+    def _directions(self, moves, node, parent):
+        '''
+        Directions to explore from node, reached from parent (pruning rules).
+        '''
+        if parent == -1:
+            return list(self.steps)
+        width = self.grid.width
+        direction = (_sign(node % width - parent % width), _sign(node // width - parent // width))
+        mask = moves[node]
+        directions = list(self.natural[direction])
+        for blocked, forced in self.forced[direction]:
+            if not mask & blocked:
+                directions.append(forced)
+        return directions
+
+    def find_path(self, start, goal):
+        '''
+        Optimal path from start to goal, both given as (x, y).
+
+        Returns:
+            list: Path as [(x1, y1), (x2, y2)...] with every cell on it
+                (not only the jump points), or None.
+        '''
+        grid = self.grid
+        grid.reset_buffers()
+        moves = memoryview(grid.moves)
+        parents = memoryview(grid.parents)
+        g_cost = memoryview(grid.g)
+        closed = memoryview(grid.closed)
+        source = grid.index(start)
+        target = grid.index(goal)
+
+        self.expanded = 0
+        g_cost[source] = 0
+        counter = itertools.count()
+        h = self.heuristic(start, goal)
+        openList = [(h, h, next(counter), 0, source)]
+        self.peak_open = 0
+        while openList:
+            if len(openList) > self.peak_open:
+                self.peak_open = len(openList)
+            f, h, _, g, node = heapq.heappop(openList)
+            if closed[node] or g > g_cost[node]:
+                continue # Stale entry.
+            closed[node] = 1
+            self.expanded += 1
+            if node == target:
+                return self._full_path(grid.path_to(target))
+            for direction in self._directions(moves, node, parents[node]):
+                child, steps = self._jump(moves, node, direction, target)
+                if child == -1 or closed[child]:
+                    continue
+                newCost = g + steps * self.steps[direction][2]
+                if g_cost[child] <= newCost:
+                    continue
+                g_cost[child] = newCost
+                parents[child] = node
+                h = self.heuristic(grid.position(child), goal)
+                heapq.heappush(openList, (newCost + h, h, next(counter), newCost, child))
+        return None # No path found.
+
+    @staticmethod
+    def _full_path(jump_points):
+        '''
+        Fills in the cells between consecutive jump points. Each segment is
+        a straight or a diagonal line, so it is walked one step at a time.
+        '''
+        path = [jump_points[0]]
+        for x, y in jump_points[1:]:
+            px, py = path[-1]
+            dx, dy = _sign(x - px), _sign(y - py)
+            while (px, py) != (x, y):
+                px, py = px + dx, py + dy
+                path.append((px, py))
+        return path
@@ -13,6 +13,7 @@ from .gym_wrapper import MDPMaze
 from .gym_wrapper import HardMaze
 from .gym_wrapper import InfHardMaze
 from .gym_wrapper import EasyMazeEnv
+from .gym_wrapper import VectorHardMaze
 
 __all__ = ['Maze', 'SHOW', 'ACTION', 'BaseAgent', 'ProbsRoulet']
 
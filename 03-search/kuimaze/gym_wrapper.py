@@ -7,7 +7,9 @@ File wrapping maze.py functionality into few methods defined by OpenAI GYM
 @copyright: (c) 2017, 2018
 '''
 
+import array
 import collections
+import collections.abc
 import os
 import sys
 import numpy as np
@@ -17,18 +19,51 @@ from gym import spaces
 from gym.utils import seeding
 
 import kuimaze
-from .map_generator import maze as mapgen_maze
+from .map_generator import generate as mapgen_maze
 
 path_section = collections.namedtuple('Path', ['state_from', 'state_to', 'cost', 'action'])
 state = collections.namedtuple('State', ['x', 'y'])
 
+
+class CompactPath(collections.abc.Sequence):
+    '''
+    Path of (x, y) positions kept as one flat array of ints, 8 bytes per
+    position instead of a tuple object and its two ints. Reads like a list
+    of tuples: len(), path[i], iteration.
+    '''
+
+    def __init__(self, positions=()):
+        self._xy = array.array('i')
+        for position in positions:
+            self._xy.append(position[0])
+            self._xy.append(position[1])
+
+    def __len__(self):
+        return len(self._xy) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('path index out of range')
+        return (self._xy[2 * index], self._xy[2 * index + 1])
+
+    def __iter__(self):
+        xy = iter(self._xy)
+        return zip(xy, xy)
+
+
 class MazeEnv(gym.Env):
     metadata = {'render.modes': ['human']}
     _path = []
     _visited = []
+    _visited_set = set()
     MAP = '../maps/easy/easy3.bmp'
 
-    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None):
+    def __init__(self, informed, gym_compatible, deter, map_image_dir=None, grad=(0, 0), node_rewards=None,
+                 hard_places_are_goals=True):
         '''
         Class wrapping Maze into gym enviroment.
         @param informed: boolean
@@ -36,6 +71,7 @@ class MazeEnv(gym.Env):
         @param deter: boolean - T = deterministic maze, F = probabilistic maze
         @param map_image_dir: string - path to image of map
         @param grad: tuple - vector tuning the tilt of maze`
+        @param hard_places_are_goals: boolean - whether the hard places are goals too, see Maze
         '''
         if map_image_dir is None:
             '''
@@ -45,19 +81,23 @@ class MazeEnv(gym.Env):
             y_size = 6                                 # not 100% accurate size, could have smaller dimensions
             complexity = 0.1                            # in interval (0, 1]
             density = 0.25                              # in interval [0, 1]
-            self.MAP = mapgen_maze(x_size, y_size, complexity, density)
+            self.MAP = mapgen_maze(x_size, y_size, complexity=complexity, density=density)
         else:
             self.MAP = map_image_dir
         if grad is None:
             self._grad = (0, 0)
         else:
             self._grad = grad
-        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards)
+        self._problem = kuimaze.Maze(self.MAP, self._grad, node_rewards=node_rewards,
+                                     hard_places_are_goals=hard_places_are_goals)
         self._player = EnvAgent(self._problem)
         self._curr_state = self._problem.get_start_state()
         self._informed = informed
         self._gym_compatible = gym_compatible
         self._deter = deter
+        if deter:
+            # Actions are never confused, the transition model of the Maze has to say so too.
+            self._problem.set_probs(1, 0, 0, 0)
         self._gui_disabled = True
         self._set = False
         # set action and observation space
@@ -76,29 +116,75 @@ class MazeEnv(gym.Env):
             action = self._problem.non_det_result(action)
         self._curr_state = self._problem.result(self._curr_state, action)
         self._path.append(self._curr_state)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._add_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         # reward = self._problem.get_state_reward(self._curr_state)
         return self._get_observation(), reward, done, None
 
-    def get_all_states(self):
+    def get_all_states(self, compact=False):
         '''
         auxiliary function for MDPs - where states (map) are supposed to be known
+        :param compact: return the states as ints y*W + x, see encode
         :return: list of states
         '''
-        return self._problem.get_all_states()
+        return self._problem.get_all_states(compact)
+
+    def encode(self, position):
+        '''
+        Compact form of a state: the int y*W + x, accepted by expand, get_next_states_and_probs and the
+        other methods taking a state, which then answer with ints as well.
+        :param position: state or (x, y)
+        :return: int
+        '''
+        return self._problem.encode(position)
+
+    def decode(self, index):
+        '''
+        Namedtuple view of a compact state, see encode.
+        :param index: int
+        :return: state
+        '''
+        return self._problem.decode(index)
+
+    def get_grad(self):
+        '''
+        auxiliary function for search - the tilt of the maze used in the costs
+        :return: tuple (grad_x, grad_y)
+        '''
+        return tuple(self._grad)
+
+    def get_free_mask(self):
+        '''
+        auxiliary function for search - occupancy grid of the maze
+        :return: read-only bool array indexed [x, y], True where there is no wall
+        '''
+        return self._problem.get_free_mask()
+
+    def get_deltas(self):
+        '''
+        auxiliary function for search - the moves used by expand, in order
+        :return: list of (dx, dy) tuples
+        '''
+        return self._problem.get_deltas()
+
+    def get_hard_places(self):
+        '''
+        auxiliary function for search - states with the extra cost for leaving them
+        :return: list of states
+        '''
+        return list(self._problem.hard_places)
 
     def reset(self):
         self._set = True
         self._gui_disabled = True
         self._path = []
         self._visited = []
+        self._visited_set = set()
         self._problem.clear_player_data()
         self._problem.set_player(self._player)
         if self._gym_compatible:
             self._path.append(self._problem.get_start_state())
-        self._visited.append(self._problem.get_start_state())
+        self._add_visited(self._problem.get_start_state())
         self._curr_state = self._problem.get_start_state()
         return self._get_observation()
 
@@ -117,6 +203,17 @@ class MazeEnv(gym.Env):
         self._problem.show_and_break()
         self._gui_on = True
 
+    def _add_visited(self, new_state):
+        '''
+        Records the state as visited. _visited keeps the order for rendering, _visited_set answers the membership
+        tests in O(1).
+        @param new_state: namedtuple state
+        @return: None
+        '''
+        if new_state not in self._visited_set:
+            self._visited_set.add(new_state)
+            self._visited.append(new_state)
+
     def close(self):
         self._gui_disabled = True
         self._problem.close_gui()
@@ -254,16 +351,19 @@ class EasyMazeEnv(MazeEnv):
     Unlike the HardMaze, EasyMaze has additional method set_path - which can set different path than agent movement.
     '''
 
-    def __init__(self, informed, map_image_dir=None, grad=(0, 0)):
-        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad)
+    def __init__(self, informed, map_image_dir=None, grad=(0, 0), hard_places_are_goals=True):
+        super(EasyMazeEnv, self).__init__(informed, False, True, map_image_dir, grad,
+                                          hard_places_are_goals=hard_places_are_goals)
         self._gui_on = False
+        self._adjacency = None
+        self._adjacency_views = None
+        self._adjacency_version = 0
 
     def step(self, action):
         last_state = self._curr_state
         assert (type(action) == list or type(action) == tuple) and len(action) == 2
         self._curr_state = self._easy_result(action)
-        if self._curr_state not in self._visited:
-            self._visited.append(self._curr_state)
+        self._add_visited(self._curr_state)
         reward, done = self._get_reward(self._curr_state, last_state)
         return self._get_observation(), reward, done, None
 
@@ -274,12 +374,15 @@ class EasyMazeEnv(MazeEnv):
     def set_path(self, path):
         '''
         This method sets enviroment to visualize your found path. Method render, must be called afterwards.
-        @param path: list of lists in format: [[x1, y1], [x2, y2], ... ]
+        @param path: list of lists in format: [[x1, y1], [x2, y2], ... ], or an iterator of positions,
+        e.g. a generator: it is then read once, straight into a CompactPath; None when no path was found
         @return: None
         '''
         ret = []
+        if isinstance(path, collections.abc.Iterator):
+            path = CompactPath(path)
         self._path = path
-        if self._gui_on:
+        if self._gui_on and path is not None:
             assert (type(path[0]) == list or type(path[0]) == tuple) and (len(path[0]) == 2 or len(path[0]) == 3)
             previus_state = None
             for state_list in path:
@@ -298,8 +401,9 @@ class EasyMazeEnv(MazeEnv):
         @param new_state:
         @return: boolean
         '''
+        if new_state in self._visited_set:
+            return True
         tmp = []
-        tmp.extend(self._visited)
         tmp.extend([self._problem.result(self._curr_state, 0), self._problem.result(self._curr_state, 1),
                     self._problem.result(self._curr_state, 2), self._problem.result(self._curr_state, 3),
                     self._problem.result(self._curr_state, 4), self._problem.result(self._curr_state, 5),
@@ -338,12 +442,124 @@ class EasyMazeEnv(MazeEnv):
             reward = pow(pow(vector[0],2) + pow(vector[1],2),1/2) + z_axis + addition_cost
         return reward
 
+    def set_grad(self, grad):
+        '''
+        Changes the tilt of the maze used in the costs returned by expand.
+        @param grad: tuple - vector tuning the tilt of maze
+        @return: None
+        '''
+        assert type(grad) == tuple or type(grad) == list
+        assert len(grad) == 2 and -1 < grad[0] < 1 and -1 < grad[1] < 1
+        self._grad = tuple(grad)
+        self.invalidate_adjacency()
+
+    def set_hard_places(self, hard_places):
+        '''
+        Replaces the hard places of the maze (states with extra cost for leaving them).
+        @param hard_places: iterable of positions (x, y)
+        @return: None
+        '''
+        self._problem.hard_places = [state(place[0], place[1]) for place in hard_places]
+        self.invalidate_adjacency()
+
+    def invalidate_adjacency(self):
+        '''
+        Drops the compiled adjacency, it is rebuilt by the next expand. Called by set_grad and set_hard_places,
+        call it directly after changing self._grad or Maze.hard_places in place.
+        @return: None
+        '''
+        self._adjacency = None
+        self._adjacency_version += 1
+
+    def get_adjacency_version(self):
+        '''
+        Number increased every time the costs of the maze change, for caches built on top of expand.
+        @return: int
+        '''
+        return self._adjacency_version
+
+    def get_adjacency(self):
+        '''
+        Returns the adjacency of the maze compiled into CSR form, built on the first call. Cell (x, y) has index
+        y*W + x and the moves from it are the entries indptr[index]:indptr[index + 1], in the order of expand.
+        @return: dict with 'width', 'height' and the numpy arrays 'indptr', 'indices' (index of the neighbour)
+                 and 'costs'; expand builds its entries from the slice of the cell
+        '''
+        if self._adjacency is None:
+            self._adjacency = self._build_adjacency()
+            # Views of the same arrays, for expand: they slice one cell faster than numpy does.
+            self._adjacency_views = tuple(memoryview(self._adjacency[key]) for key in ('indptr', 'indices', 'costs'))
+        return self._adjacency
+
+    def _build_adjacency(self):
+        '''
+        Compiles the neighbours and costs of all cells at once, with the same arithmetic as _get_cost.
+        @return: dict, see get_adjacency
+        '''
+        free = np.ascontiguousarray(self._problem.get_free_mask().T)  # indexed [y, x]
+        height, width = free.shape
+        padded = np.zeros((height + 2, width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = free
+        deltas = self._problem.get_deltas()
+        valid = np.zeros((height, width, len(deltas)), dtype=bool)
+        offsets = np.zeros(len(deltas), dtype=np.int64)
+        base = np.zeros(len(deltas), dtype=float)
+        for k, (dx, dy) in enumerate(deltas):
+            valid[:, :, k] = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+            offsets[k] = dy * width + dx
+            vector = [-dx, -dy]  # _get_cost is called as (position, new_state)
+            z_axis = vector[0] * self._grad[0] + vector[1] * self._grad[1]
+            base[k] = pow(pow(vector[0], 2) + pow(vector[1], 2), 1/2) + z_axis
+        addition = np.zeros(height * width, dtype=float)
+        for place in self._problem.hard_places:
+            addition[place.y * width + place.x] = 5
+
+        valid = valid.reshape(height * width, len(deltas))
+        indptr = np.zeros(height * width + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=indptr[1:])
+        cells, moves = np.nonzero(valid)  # ordered by cell, then by move
+        return {
+            'width': width,
+            'height': height,
+            'indptr': indptr,
+            'indices': cells + offsets[moves],
+            'costs': base[moves] + addition[cells],
+        }
+
     def expand(self,position):
         '''
         returns tuple of positions with associated costs that can be visited from "position"
-        @param position: position in the maze defined by coordinates (x,y)
+        @param position: position in the maze defined by coordinates (x,y), or a compact state (int y*W + x)
 
-        @return: tuple of coordinates [x, y] with "cost" for movement to these positions: [[[x1, y1], cost1], [[x2, y2], cost2], ... ]
+        @return: tuple of coordinates [x, y] with "cost" for movement to these positions: [[(x1, y1), cost1], [(x2, y2), cost2], ... ]
+                 for a compact state: [(index1, cost1), (index2, cost2), ...]
+        '''
+        adjacency = self.get_adjacency()
+        width = adjacency['width']
+        compact = isinstance(position, (int, np.integer))
+        if compact:
+            index = position
+        else:
+            x, y = position[0], position[1]
+            if not (0 <= x < width and 0 <= y < adjacency['height']):
+                return self._expand_result(position)
+            index = y * width + x
+        indptr, indices, costs = self._adjacency_views
+        lo, hi = indptr[index], indptr[index + 1]
+        indices = indices[lo:hi].tolist()
+        costs = costs[lo:hi].tolist()
+        neighbours = [(neighbour % width, neighbour // width) for neighbour in indices]
+        for neighbour in neighbours:
+            # A tuple finds the equal state in the set, the state itself is only made for a new one.
+            if neighbour not in self._visited_set:
+                self._add_visited(state(*neighbour))
+        return list(zip(indices if compact else neighbours, costs))
+
+    def _expand_result(self, position):
+        '''
+        expand through Maze.result, for positions outside of the compiled adjacency
+        @param position: position in the maze defined by coordinates (x,y)
+        @return: see expand
         '''
         expanded_nodes = []
         maze_pose = state(position[0], position[1])
@@ -354,8 +570,7 @@ class EasyMazeEnv(MazeEnv):
         for new_state in tmp:
             if new_state.x == maze_pose.x and new_state.y == maze_pose.y:
                 continue
-            if new_state not in self._visited:
-                self._visited.append(new_state)
+            self._add_visited(new_state)
             reward = self._get_cost(maze_pose, new_state)
             expanded_nodes.append([(new_state.x, new_state.y), reward])
         return expanded_nodes
@@ -391,7 +606,8 @@ class InfEasyMaze(EasyMazeEnv):
     step([x, y])
     '''
     def __init__(self, map_image=None, grad=(0, 0)):
-        super(InfEasyMaze, self).__init__(True, map_image, grad)
+        # The search problems look for the goal only, hard places are just expensive.
+        super(InfEasyMaze, self).__init__(True, map_image, grad, hard_places_are_goals=False)
 
 
 class EasyMaze(EasyMazeEnv):
@@ -447,6 +663,13 @@ class MDPMaze(MazeEnv):
     def get_next_states_and_probs(self, state, action):
         return self._problem.get_next_states_and_probs(state, action)
 
+    def get_transition_model(self):
+        '''
+        The whole transition model as arrays, see L{kuimaze.maze.TransitionModel}. Cached by the Maze,
+        until set_probs_table changes the probabilities.
+        '''
+        return self._problem.get_transition_model()
+
     def get_state_reward(self,curr):
         return self._problem.get_state_reward(curr)
 
@@ -495,3 +718,99 @@ class InfHardMaze(MazeEnv):
             self._problem.set_probs(probs[0], probs[1], probs[2], probs[3])    # set probabilities here
         else:
             super(InfHardMaze, self).__init__(True, True, True, map_image, grad)
+
+
+class VectorHardMaze:
+    '''
+    N agents in the same HardMaze, stepped together with NumPy, for Q-learning and evaluation jobs
+    that need many steps. Rewards, confusion and goals are those of HardMaze, but the states are the
+    compact ones (int y*W + x, see MazeEnv.encode), and an agent that reaches a goal starts again at
+    the start state in the same step. Nothing is recorded for rendering.
+
+    All agents share one Maze; a compiled map (see kuimaze.map_compiler) is also shared, read-only,
+    by the processes that load it.
+    '''
+    def __init__(self, map_image=None, num_envs=1, grad=(0, 0), probs=None, node_rewards=None, seed=None):
+        '''
+        @param map_image: anything kuimaze.Maze takes (None for a random map, as MazeEnv)
+        @param num_envs: int - number of agents
+        @param grad: tuple - vector tuning the tilt of maze
+        @param probs: tuple - (obey, confusionL, confusionR, confusion180), None for a deterministic maze
+        @param node_rewards: see kuimaze.Maze
+        @param seed: seed of the numpy.random.Generator of the confusion
+        '''
+        if map_image is None:
+            map_image = mapgen_maze(6, 6, complexity=0.1, density=0.25)
+        self._grad = (0, 0) if grad is None else grad
+        self._problem = kuimaze.Maze(map_image, self._grad, node_rewards=node_rewards)
+        self._roulette = None if probs is None else kuimaze.ProbsRoulette(probs[0], probs[1], probs[2], probs[3])
+        self.num_envs = num_envs
+        self.seed(seed)
+        model = self._problem.get_transition_model()
+        width = self._problem.get_dimensions()[0]
+        #: compact state of each row of the tables below, positions are kept as rows
+        self._states = model.states
+        xs, ys = model.states % width, model.states // width
+        # Outcome k of any action moves in the direction of ACTION k, so any action's row of next_states will do.
+        self._moves = np.ascontiguousarray(model.next_states[:, 0, :])
+        # z of each state; moving from s to t changes the reward by z(s) - z(t), as in HardMaze._get_reward.
+        self._depth = xs * self._grad[0] + ys * self._grad[1]
+        self._rewards = model.rewards
+        self._goal = np.array([self._problem.is_goal_state((x, y)) for x, y in zip(xs.tolist(), ys.tolist())],
+                              dtype=bool)
+        # The goal reward is added on arrival, so it can be added with the reward for leaving.
+        self._arrival = np.where(self._goal, self._rewards, 0)
+        start = self._problem.get_start_state()
+        self._start = int(np.flatnonzero(self._states == self._problem.encode(start))[0])
+        self._positions = np.full(num_envs, self._start, dtype=np.int64)
+
+    def seed(self, seed=None):
+        self.np_random = np.random.default_rng(seed)
+        return [seed]
+
+    def reset(self):
+        '''
+        Puts all agents on the start state.
+        @return: int array (N,) - compact states of the agents
+        '''
+        self._positions.fill(self._start)
+        return self._states[self._positions]
+
+    def step(self, actions):
+        '''
+        Moves every agent by its action, 0 <= action <= 3.
+        @param actions: int array (N,)
+        @return: (states, rewards, dones, info): int array (N,) of the compact states after the step (the start
+        for the agents that reached a goal), float array (N,) of rewards, bool array (N,) telling who reached a
+        goal, and a dict with 'final_states', the compact states the step led to before the reset
+        '''
+        actions = np.asarray(actions)
+        if self._roulette is not None:
+            actions = self._roulette.confuse_actions(actions, self.np_random)
+        last = self._positions
+        positions = self._moves[last, actions]
+        rewards = self._rewards[last] + (self._depth[last] - self._depth[positions]) + self._arrival[positions]
+        dones = self._goal[positions]
+        final_states = self._states[positions]
+        positions[dones] = self._start
+        self._positions = positions
+        return self._states[positions], rewards, dones, {'final_states': final_states}
+
+    def get_observation(self):
+        '''
+        The observations HardMaze would give.
+        @return: float array (N, 3) - x, y and depth (z relative to the start state) of each agent
+        '''
+        width = self._problem.get_dimensions()[0]
+        states = self._states[self._positions]
+        depth = np.round(self._depth[self._positions] - self._depth[self._start], 3)
+        return np.stack([states % width, states // width, depth], axis=1)
+
+    def encode(self, position):
+        return self._problem.encode(position)
+
+    def decode(self, index):
+        return self._problem.decode(index)
+
+    def get_all_states(self, compact=True):
+        return self._problem.get_all_states(compact)
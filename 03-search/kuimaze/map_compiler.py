@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Map compiler - parses a map once (.bmp/.png image, ImageMagick .txt pixel dump or a list of RGB rows)
+and stores the result as a .npy file, which L{kuimaze.Maze} loads memory-mapped, without PIL and without
+looking at the colours again. Processes loading the same compiled map share it in the page cache.
+
+Usage::
+
+    python -m kuimaze.map_compiler maps/easy/*.bmp maps_difficult/*.txt
+'''
+
+import os
+import re
+import sys
+
+import numpy as np
+
+#: Version of the compiled format, part of the file name, so that files of another version are never loaded.
+FORMAT_VERSION = 1
+#: End of the file names of compiled maps.
+SUFFIX = '.v{}.npy'.format(FORMAT_VERSION)
+#: Layout of one cell of a compiled map: its flags and its default reward. Compiled maps are indexed [x, y].
+CELL_DTYPE = np.dtype([('flags', 'u1'), ('reward', '<f8')])
+
+#: Flags of a cell.
+FREE = 1
+START = 2
+GOAL = 4
+HARD = 8
+
+WALL_COLOR = (0, 0, 0)
+START_COLOR = (0, 0, 255)
+GOAL_COLOR = (255, 0, 0)
+HARD_COLOR = (0, 255, 0)
+
+REWARD_NORMAL = -0.04 # e.g. energy consumption
+REWARD_DANGER = -1
+REWARD_GOAL = 1
+
+_PIXEL = re.compile(r'^\s*(\d+)\s*,\s*(\d+)\s*:\s*\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)')
+
+
+def compiled_path(source):
+    '''
+    Path of the compiled map of the source map file, next to it.
+    @param source: path to a map file
+    @return: string
+    '''
+    return os.path.splitext(source)[0] + SUFFIX
+
+
+def is_compiled(path):
+    '''
+    @return: True if the path is a compiled map of this version
+    '''
+    return isinstance(path, str) and path.endswith(SUFFIX)
+
+
+def read_txt(path):
+    '''
+    Reads an ImageMagick pixel enumeration (convert map.bmp map.txt).
+    @return: numpy.ndarray of shape (height, width, 3)
+    '''
+    with open(path) as txt:
+        header = txt.readline()
+        assert header.startswith('# ImageMagick pixel enumeration:'), 'not an ImageMagick pixel dump: ' + path
+        width, height = (int(size) for size in header.split(':')[1].split(',')[:2])
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        for line in txt:
+            match = _PIXEL.match(line)
+            if match:
+                x, y, r, g, b = (int(value) for value in match.groups())
+                pixels[y, x] = (r, g, b)
+    return pixels
+
+
+def read_pixels(source):
+    '''
+    Pixels of a map given as a path to an image or .txt pixel dump, a PIL image or a list of rows of RGB triples.
+    @return: numpy.ndarray of shape (height, width, 3)
+    '''
+    if isinstance(source, str) and source.endswith('.txt'):
+        return read_txt(source)
+    if isinstance(source, str):
+        from PIL import Image
+        source = Image.open(source)
+    pixels = np.array(source, dtype=int)
+    assert (len(pixels.shape) == 3 and pixels.shape[2] == 3)
+    return pixels
+
+
+def compile_pixels(pixels):
+    '''
+    Parses the colours of the map.
+
+    white color - empty space, black color - wall, blue color - start (the last blue pixel, row by row, if
+    there are more of them), red color - goal, green color - hard place (any other color is empty space too).
+
+    @param pixels: array of shape (height, width, 3)
+    @return: numpy.ndarray of CELL_DTYPE and shape (width, height)
+    '''
+    pixels = np.asarray(pixels)
+
+    def mask(color):
+        return ((pixels[:, :, 0] == color[0]) & (pixels[:, :, 1] == color[1]) & (pixels[:, :, 2] == color[2])).T
+
+    cells = np.zeros(pixels.shape[1::-1], dtype=CELL_DTYPE)
+    flags = np.where(pixels.any(axis=2).T, FREE, 0).astype(np.uint8)
+    ys, xs = np.nonzero(mask(START_COLOR).T)
+    if len(xs):
+        flags[xs[-1], ys[-1]] |= START
+    goals = mask(GOAL_COLOR)
+    hard = mask(HARD_COLOR)
+    flags |= np.where(goals, GOAL, 0).astype(np.uint8)
+    flags |= np.where(hard, HARD, 0).astype(np.uint8)
+    cells['flags'] = flags
+    # Danger overrides goal, as the hard places may be goals too.
+    cells['reward'] = np.where(hard, REWARD_DANGER, np.where(goals, REWARD_GOAL, REWARD_NORMAL))
+    return cells
+
+
+def compile_walls(walls, start, goals=(), hard_places=()):
+    '''
+    Builds the compiled map from a wall mask, e.g. of L{kuimaze.map_generator}, without any image.
+    @param walls: bool array of shape (height, width), True for a wall
+    @param start: (x, y) of the start
+    @param goals: (x, y) of the goals
+    @param hard_places: (x, y) of the hard places
+    @return: numpy.ndarray of CELL_DTYPE and shape (width, height)
+    '''
+    walls = np.asarray(walls, dtype=bool)
+    cells = np.zeros(walls.shape[::-1], dtype=CELL_DTYPE)
+    flags = np.where(walls.T, 0, FREE).astype(np.uint8)
+    rewards = np.full(flags.shape, REWARD_NORMAL)
+    for places, flag, reward in ((goals, GOAL, REWARD_GOAL), (hard_places, HARD, REWARD_DANGER)):
+        for x, y in places:
+            flags[x, y] |= flag
+            rewards[x, y] = reward
+    flags[start[0], start[1]] |= START
+    cells['flags'] = flags
+    cells['reward'] = rewards
+    return cells
+
+
+def compile_map(source, destination=None):
+    '''
+    Compiles the map and saves it.
+    @param source: anything read_pixels takes
+    @param destination: path of the compiled map, compiled_path(source) by default
+    @return: path of the compiled map
+    '''
+    if destination is None:
+        destination = compiled_path(source)
+    return save(compile_pixels(read_pixels(source)), destination)
+
+
+def save(cells, destination):
+    '''
+    Saves a compiled map, e.g. of compile_walls.
+    @return: destination
+    '''
+    assert cells.dtype == CELL_DTYPE and cells.ndim == 2
+    # np.save adds .npy to a file name without it, an open file keeps the name as it is.
+    with open(destination, 'wb') as output:
+        np.save(output, cells)
+    return destination
+
+
+def load(path):
+    '''
+    Loads a compiled map, memory-mapped and read-only.
+    @return: numpy.ndarray of CELL_DTYPE and shape (width, height)
+    @raise ValueError: when the file is not a compiled map of this version
+    '''
+    cells = np.load(path, mmap_mode='r')
+    if cells.dtype != CELL_DTYPE or cells.ndim != 2:
+        raise ValueError('{} is not a compiled map of version {}'.format(path, FORMAT_VERSION))
+    return cells
+
+
+def positions(mask):
+    '''
+    (x, y) of the cells of the mask indexed [x, y], row by row, as the pixels of the image are scanned.
+    @return: list of (x, y) tuples
+    '''
+    ys, xs = np.nonzero(np.asarray(mask).T)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python -m kuimaze.map_compiler MAP...')
+        sys.exit(1)
+    for source in sys.argv[1:]:
+        print(source, '->', compile_map(source))
@@ -3,14 +3,22 @@ Simple maze generator
 '''
 
 import numpy
-from numpy.random import random_integers as rand
 
+from kuimaze import map_compiler
 
-def maze(width=10, height=10, complexity=.75, density=.75):
-    # Only odd shapes
+#: Algorithms of walls(). 'aisles' is the original random aisles of maze(), 'division' (recursive division)
+#: and 'kruskal' (randomized Kruskal with union-find) make perfect mazes, with exactly one path between two cells.
+ALGORITHMS = ('aisles', 'division', 'kruskal')
+
+
+def _shape(width, height):
+    # Only odd shapes, with the border
     width = width + 1
     height = height + 1
-    shape = ((height // 2) * 2 + 1, (width // 2) * 2 + 1)
+    return ((height // 2) * 2 + 1, (width // 2) * 2 + 1)
+
+
+def _aisles(shape, rng, complexity, density):
     # Adjust complexity and density relative to maze size
     complexity = int(complexity * (5 * (shape[0] + shape[1])))
     density    = int(density * ((shape[0] // 2) * (shape[1] // 2)))
@@ -21,7 +29,7 @@ def maze(width=10, height=10, complexity=.75, density=.75):
     Z[:, 0] = Z[:, -1] = 1
     # Make aisles
     for i in range(density):
-        x, y = rand(0, shape[1] // 2) * 2, rand(0, shape[0] // 2) * 2
+        x, y = rng.integers(0, shape[1] // 2, endpoint=True) * 2, rng.integers(0, shape[0] // 2, endpoint=True) * 2
         Z[y, x] = 1
         for j in range(complexity):
             neighbours = []
@@ -34,22 +42,118 @@ def maze(width=10, height=10, complexity=.75, density=.75):
             if y < shape[0] - 2:
                 neighbours.append((y + 2, x))
             if len(neighbours):
-                y_,x_ = neighbours[rand(0, len(neighbours) - 1)]
+                y_,x_ = neighbours[rng.integers(0, len(neighbours) - 1, endpoint=True)]
                 if Z[y_, x_] == 0:
                     Z[y_, x_] = 1
                     Z[y_ + (y - y_) // 2, x_ + (x - x_) // 2] = 1
                     x, y = x_, y_
+    return Z
+
+
+def _division(shape, rng):
+    # Cells with both coordinates odd are rooms, walls are drawn on even rows and columns.
+    Z = numpy.zeros(shape, dtype=bool)
+    Z[0, :] = Z[-1, :] = 1
+    Z[:, 0] = Z[:, -1] = 1
+    # Chambers as (first row, first column, last row, last column) of their rooms.
+    chambers = [(1, 1, shape[0] - 2, shape[1] - 2)]
+    # Random numbers for all splits at once, one call per split would take most of the time.
+    draws = iter(rng.random(3 * ((shape[0] // 2) * (shape[1] // 2) + 1)).tolist())
+    while chambers:
+        y0, x0, y1, x1 = chambers.pop()
+        rows = (y1 - y0) // 2 + 1
+        columns = (x1 - x0) // 2 + 1
+        if rows < 2 or columns < 2:
+            continue # A corridor, its walls would be all gap.
+        if rows > columns or (rows == columns and next(draws) < 0.5):
+            # Horizontal wall with one gap.
+            y = y0 + 1 + 2 * int(next(draws) * (rows - 1))
+            gap = x0 + 2 * int(next(draws) * columns)
+            Z[y, x0:x1 + 1] = 1
+            Z[y, gap] = 0
+            chambers.append((y0, x0, y - 1, x1))
+            chambers.append((y + 1, x0, y1, x1))
+        else:
+            # Vertical wall with one gap.
+            x = x0 + 1 + 2 * int(next(draws) * (columns - 1))
+            gap = y0 + 2 * int(next(draws) * rows)
+            Z[y0:y1 + 1, x] = 1
+            Z[gap, x] = 0
+            chambers.append((y0, x0, y1, x - 1))
+            chambers.append((y0, x + 1, y1, x1))
+    return Z
+
+
+def _kruskal(shape, rng):
+    # Everything is a wall but the rooms (both coordinates odd); the walls between rooms are
+    # removed in random order, unless the rooms are already connected.
+    Z = numpy.ones(shape, dtype=bool)
+    Z[1::2, 1::2] = 0
+    rows, columns = (shape[0] - 1) // 2, (shape[1] - 1) // 2
+    rooms = numpy.arange(rows * columns).reshape(rows, columns)
+    # Each edge is (room, neighbouring room, y, x of the wall between them).
+    side_y, side_x = numpy.mgrid[1:shape[0]:2, 2:shape[1] - 1:2]
+    below_y, below_x = numpy.mgrid[2:shape[0] - 1:2, 1:shape[1]:2]
+    edges = numpy.concatenate([
+        numpy.stack([rooms[:, :-1].ravel(), rooms[:, 1:].ravel(), side_y.ravel(), side_x.ravel()], axis=1),
+        numpy.stack([rooms[:-1, :].ravel(), rooms[1:, :].ravel(), below_y.ravel(), below_x.ravel()], axis=1)])
+    edges = edges[rng.permutation(len(edges))]
+    parents = list(range(rows * columns))
+    carved = bytearray(len(edges))
+    for i, (first, second) in enumerate(edges[:, :2].tolist()):
+        # Roots of both rooms, with path halving (inline, this loop runs for every wall).
+        while parents[first] != first:
+            parents[first] = first = parents[parents[first]]
+        while parents[second] != second:
+            parents[second] = second = parents[parents[second]]
+        if first != second:
+            parents[first] = second
+            carved[i] = 1
+    carved = numpy.frombuffer(carved, dtype=bool)
+    Z[edges[carved, 2], edges[carved, 3]] = 0
+    return Z
+
+
+def walls(width=10, height=10, algorithm='aisles', seed=None, complexity=.75, density=.75):
+    '''
+    Wall mask of a random maze.
+    @param width, height: size of the maze, rounded down to an odd number
+    @param algorithm: one of ALGORITHMS
+    @param seed: seed of the numpy.random.Generator, or the Generator itself; None for a random maze
+    @param complexity, density: only for 'aisles', see maze()
+    @return: numpy.ndarray of bool, True for a wall, indexed [y, x] as the pixels of a map image
+    '''
+    assert algorithm in ALGORITHMS, 'unknown algorithm ' + str(algorithm)
+    rng = numpy.random.default_rng(seed)
+    shape = _shape(width, height)
+    if algorithm == 'division':
+        Z = _division(shape, rng)
+    elif algorithm == 'kruskal':
+        Z = _kruskal(shape, rng)
+    else:
+        Z = _aisles(shape, rng, complexity, density)
+    # Without the border, the edge of the map is a wall already
+    return Z[1:-1, 1:-1]
+
+
+def generate(width=10, height=10, algorithm='aisles', seed=None, complexity=.75, density=.75):
+    '''
+    Random maze ready for L{kuimaze.Maze}, with the start in the top left corner and the goal in the
+    bottom right one, without the RGB image in between.
+    @return: numpy.ndarray of L{map_compiler.CELL_DTYPE}, indexed [x, y]
+    '''
+    Z = walls(width, height, algorithm, seed, complexity, density)
+    return map_compiler.compile_walls(Z, (0, 0), [(Z.shape[1] - 1, Z.shape[0] - 1)])
+
+
+def maze(width=10, height=10, complexity=.75, density=.75, seed=None):
+    '''
+    Random maze made of aisles, as a list of rows of [r, g, b] for L{kuimaze.Maze}.
+    Prefer generate(), which does not build the lists.
+    '''
+    Z = walls(width, height, 'aisles', seed, complexity, density)
     # convert to maze.py format
-    ret = [[0 for x in range(len(Z[0]) - 2)] for y in range(len(Z) - 2)]
-    for i in range(len(Z)):
-        for j in range(len(Z[0])):
-            if i > 0 and j > 0 and i < len(Z) - 1 and j < len(Z[0]) - 1:
-                if Z[i][j] == 1:
-                    ret[i - 1][j - 1] = [0, 0, 0]
-                else:
-                    ret[i - 1][j - 1] = [255, 255, 255]
-                    if i == 1 and j == 1:
-                        ret[i - 1][j - 1] = [0, 0, 255]
-                    if i == len(Z) - 2 and j == len(Z[0]) - 2:
-                        ret[i - 1][j - 1] = [255, 0, 0]
-    return ret
+    ret = numpy.where(Z[:, :, None], 0, 255).repeat(3, axis=2)
+    ret[0, 0] = [0, 0, 255]
+    ret[-1, -1] = [255, 0, 0]
+    return ret.tolist()
@@ -8,19 +8,21 @@ Main part of kuimaze - framework for working with mazes. Contains class Maze (ca
 @copyright: (c) 2017, 2018
 '''
 
+import bisect
 import collections
 import enum
 import numpy as np
 import os
 import random
 import warnings
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import sys
-import inspect
 
 import tkinter
 
 import kuimaze
+from kuimaze import map_compiler
+from kuimaze.map_compiler import REWARD_NORMAL, REWARD_DANGER, REWARD_GOAL
 
 # nicer warnings
 fw_orig = warnings.formatwarning
@@ -34,6 +36,34 @@ state = collections.namedtuple('State', ['x', 'y'])
 #: Namedtuple to hold path_section from state A to state B. Expects C{state_from} and C{state_to} to be of type L{state} or L{weighted_state}
 path_section = collections.namedtuple('Path', ['state_from', 'state_to', 'cost', 'action'])
 
+
+class TransitionModel(collections.namedtuple('TransitionModel', ['states', 'next_states', 'probs', 'rewards', 'terminal'])):
+    '''
+    The whole transition model of a maze, see L{Maze.get_transition_model}. With S free states, A = 4 actions
+    and K = 4 outcomes of each action, where outcome k is a move in the absolute direction L{ACTION}(k)
+    (not relative to the action: for action a, outcome a is the intended move, the others the confused ones):
+
+    states - int array (S,), the compact state (see L{Maze.encode}) of each row
+    next_states - int array (S, A, K), row of the state reached from state s by moving in direction k
+    probs - float array (A, K), probability that action a moves in direction k, the same in every state
+    rewards - float array (S,), reward of each state
+    terminal - bool array (S,), goal or danger states
+
+    Rows of next_states may repeat a state (bumping into walls), the probabilities of the repeats add up.
+    '''
+    __slots__ = ()
+
+    def dense(self):
+        '''
+        @return: float array P of shape (S, A, S), P[s, a, t] is the probability of getting from s to t by action a
+        '''
+        count, actions, outcomes = self.next_states.shape
+        dense = np.zeros((count, actions, count))
+        rows = np.arange(count)[:, None, None]
+        np.add.at(dense, (rows, np.arange(actions)[None, :, None], self.next_states),
+                  np.broadcast_to(self.probs, self.next_states.shape))
+        return dense
+
 # constants used for GUI drawing
 #: Maximum size of one cell in GUI in pixels. If problem is too large to fit on screen, the cell size will be smaller
 MAX_CELL_SIZE = 200
@@ -63,10 +93,6 @@ FONT_FAMILY = "Helvetica"
 #: Text size in GUI (not on Canvas itself)
 FONT_SIZE = round(12*MAX_CELL_SIZE/50)
 
-REWARD_NORMAL = -0.04 # e.g. energy consumption
-REWARD_DANGER = -1
-REWARD_GOAL = 1
-
 class SHOW(enum.Enum):
     '''
     Enum class used for storing what is displayed in GUI - everything higher includes everything lower (except NONE, of course).
@@ -99,7 +125,14 @@ class ACTION(enum.Enum):
 class ProbsRoulette:
     '''
     Class for probabilistic maze - implements roulette wheel with intervals
+
+    The probabilities are also kept as a 4x4 confusion matrix, matrix[a, o] being the probability that the
+    commanded action a ends as action o (indexed by the values of L{ACTION}), and the wheel itself as the
+    cumulative bounds of its intervals, so that sampling is one bisection and many actions can be confused
+    at once with L{confuse_actions()<confuse_actions>}.
     '''
+    #: Change of the action in each interval of the wheel: obey, confused left, right and back.
+    OFFSETS = (0, -1, 1, 2)
 
     def __init__(self, obey=0.8, confusionL=0.1, confusionR=0.1, confusion180=0):
         # create bounds -> use defined method 'set_probs' outside init
@@ -114,59 +147,60 @@ class ProbsRoulette:
         assert 0 <= confusionL <= 1
         assert 0 <= confusionR <= 1
         assert 0 <= confusion180 <= 1
+        self._set_table(obey, confusionL, confusionR, confusion180)
+
+    def _set_table(self, obey, confusionL, confusionR, confusion180):
         self._obey = obey
         self._confusionLeft = self._obey + confusionL
         self._confusionRight = self._confusionLeft + confusionR
+        self._bounds = [self._obey, self._confusionLeft, self._confusionRight]
+        self.matrix = np.zeros((4, 4))
+        for action in range(4):
+            for offset, prob in zip(self.OFFSETS, (obey, confusionL, confusionR, confusion180)):
+                self.matrix[action, (action + offset) % 4] += prob
+        #: Rows of the matrix as lists, for lookups without NumPy scalars.
+        self.rows = self.matrix.tolist()
+
+    def __getitem__(self, item):
+        '''
+        @param item: (commanded action, resulting action), L{ACTION} or int
+        @return: probability that the commanded action ends as the resulting one
+        '''
+        action, out_action = item
+        return self.rows[getattr(action, 'value', action)][getattr(out_action, 'value', out_action)]
 
     def confuse_action(self, action):
         roulette = random.uniform(0.0, 1.0)
-        if 0 <= roulette < self._obey:
-            return action
-        else:
-            # Confused left
-            if self._obey <= roulette < self._confusionLeft:
-                return (action - 1) % 4
-            else:
-                # Confused right
-                if self._confusionLeft <= roulette < self._confusionRight:
-                    return (action + 1) % 4
-                else:
-                    # Confused back
-                    return (action + 2) % 4
+        # The interval the roulette fell in: obey, left, right or back
+        return (action + self.OFFSETS[bisect.bisect_right(self._bounds, roulette)]) % 4
+
+    def confuse_actions(self, actions, rng=None):
+        '''
+        Confuses many actions at once, e.g. of many simulated agents.
+        @param actions: int array of the commanded actions
+        @param rng: numpy.random.Generator, a new unseeded one by default
+        @return: int array of the actions really taken
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        actions = np.asarray(actions)
+        roulette = rng.random(actions.shape)
+        return (actions + np.array(self.OFFSETS)[np.searchsorted(self._bounds, roulette, side='right')]) % 4
 
     def __str__(self):
-        return str(self.probtable)
+        return str(self.matrix)
 
 
-class ActionProbsTable:
+class ActionProbsTable(ProbsRoulette):
     def __init__(self, obey=0.8, confusionL=0.1, confusionR=0.1, confusion180=0):
         assert abs(1-(obey+confusionR+confusionL+confusion180)) < 0.00001
-        # self.obey = obey
-        # self.confusion90 = confusion90
-        # self.confusion180 = confusion180
-        self.probtable = dict()
-        self.probtable[ACTION.UP, ACTION.LEFT] = confusionL
-        self.probtable[ACTION.UP, ACTION.UP] = obey
-        self.probtable[ACTION.UP, ACTION.RIGHT] = confusionR
-        self.probtable[ACTION.UP, ACTION.DOWN] = confusion180
-
-        self.probtable[ACTION.RIGHT, ACTION.LEFT] = confusion180
-        self.probtable[ACTION.RIGHT, ACTION.UP] = confusionL
-        self.probtable[ACTION.RIGHT, ACTION.RIGHT] = obey
-        self.probtable[ACTION.RIGHT, ACTION.DOWN] = confusionR
-
-        self.probtable[ACTION.DOWN, ACTION.LEFT] = confusionR
-        self.probtable[ACTION.DOWN, ACTION.UP] = confusion180
-        self.probtable[ACTION.DOWN, ACTION.RIGHT] = confusionL
-        self.probtable[ACTION.DOWN, ACTION.DOWN] = obey
-
-        self.probtable[ACTION.LEFT, ACTION.LEFT] = obey
-        self.probtable[ACTION.LEFT, ACTION.UP] = confusionR
-        self.probtable[ACTION.LEFT, ACTION.RIGHT] = confusion180
-        self.probtable[ACTION.LEFT, ACTION.DOWN] = confusionL
+        self._set_table(obey, confusionL, confusionR, confusion180)
 
-    def __getitem__(self, item):
-        return self.probtable[item]
+    @property
+    def probtable(self):
+        # the same as the matrix, keyed by ACTION pairs; read from the rows, so set_probs keeps it up to date
+        return {(action, out_action): self.rows[action.value][out_action.value]
+                for action in ACTION for out_action in ACTION}
 
     def __str__(self):
         return str(self.probtable)
@@ -182,11 +216,13 @@ class Maze:
     # __ACTIONS = [ACTION.UP, ACTION.RIGHT, ACTION.DOWN, ACTION.LEFT, ACTION.RIGHT_UP, ACTION.RIGHT_DOWN, ACTION.LEFT_UP, ACTION.LEFT_DOWN]
 
     def __init__(self, image, grad, node_rewards=None, path_costs=None, trans_probs=None, show_level=SHOW.FULL_MAZE,
-                 start_node=None, goal_nodes=None, ):
+                 start_node=None, goal_nodes=None, hard_places_are_goals=True):
         '''
         Parameters node_rewards, path_costs and trans_probs are meant for defining more complicated mazes. Parameter start_node redefines start state completely, parameter goal_nodes will add nodes to a list of goal nodes.
 
         @param image: path_section to an image file describing problem. Expects to find RGB image in given path_section
+        (or an ImageMagick .txt pixel dump of it, or a map compiled by L{kuimaze.map_compiler}, which is loaded memory-mapped,
+        or the compiled map itself, as made by L{kuimaze.map_generator.generate})
 
             white color - empty space
 
@@ -208,18 +244,23 @@ class Maze:
         @type start_node: L{namedtuple state<state>} or None for default start state loaded from image.
         @keyword goal_nodes: Appending to a list of goal nodes. Must be valid nodes inside a problem without a wall.
         @type goal_nodes: iterable of L{namedtuples state<state>} or None for default set of goal nodes loaded from image.
+        @keyword hard_places_are_goals: whether the hard places (green color) are goal nodes too. They have to be for
+        the MDP and RL problems, but must not be for the search problems (InfEasyMaze).
+        @type hard_places_are_goals: boolean
 
         @raise AssertionError: When image is not RGB image or if show is not of type L{kuimaze.SHOW} or if initialization didn't finish correctly.
         '''
-        try:
-            im_data = Image.open(image)
+        if map_compiler.is_compiled(image):
+            cells = map_compiler.load(image)
             self.__filename = image
-        except:
-            im_data = image
+        elif isinstance(image, np.ndarray) and image.dtype == map_compiler.CELL_DTYPE:
+            cells = image # already compiled, e.g. by map_generator.generate
             self.__filename = 'given'
-        maze = np.array(im_data, dtype=int)
-        assert (len(maze.shape) == 3 and maze.shape[2] == 3)
-        self.__maze = maze.sum(axis=2, dtype=bool).T
+        else:
+            cells = map_compiler.compile_pixels(map_compiler.read_pixels(image))
+            self.__filename = image if isinstance(image, str) else 'given'
+        flags = cells['flags']
+        self.__maze = (flags & map_compiler.FREE).astype(bool)
         self.__start = None
         self.__finish = None
         self.hard_places = []
@@ -243,25 +284,21 @@ class Maze:
         self.__set_grad_data()
 
         self.__has_triangles = False
+        self.__result_table = None
+        self.__transition_model = None
 
-        maze = maze.tolist()
         finish = []
         if start_node is None or goal_nodes is None:
-            for y, col in enumerate(maze):
-                for x, cell in enumerate(col):
-                    if cell == [255, 0, 0]:
-                        finish.append(state(x, y))
-                    if cell == [0, 0, 255]:
-                        self.__start = state(x, y)
-                    if cell == [0, 255, 0]:
-                        self.hard_places.append(state(x, y))
-                        # really dirty hack, just for the quick fix of AE TODO: fix it rigorously!
-                        # https://stackoverflow.com/questions/2654113/python-how-to-get-the-callers-method-name-in-the-called-method
-                        # print('Caller was', str(inspect.stack()[1:]), 'InfEasy' in str(inspect.stack()[1:]))
-                        if not('InfEasyMaze' in str(inspect.stack()[1:])):
-                            finish.append(state(x,y)) # problem for the Search, but needed for the MDP and RL
-                        else:
-                            print('InfEasyMaze was the caller, hard_places are not added to the goals')
+            # The cells are listed row by row, in the same order as a scan of the image.
+            def cells_with(flag):
+                return [state(x, y) for x, y in map_compiler.positions(flags & flag)]
+            finish = cells_with(map_compiler.GOAL)
+            starts = cells_with(map_compiler.START)
+            if starts:
+                self.__start = starts[-1]
+            self.hard_places = cells_with(map_compiler.HARD)
+            if hard_places_are_goals:
+                finish.extend(self.hard_places) # problem for the Search, but needed for the MDP and RL
             self.__finish = frozenset(finish)
 
         if start_node is not None:
@@ -290,15 +327,12 @@ class Maze:
             print(self.__node_rewards)
 
         if self.__node_rewards is None:
-            self.__node_rewards = np.zeros(self.__maze.shape, dtype=float)
-            for y, col in enumerate(maze):
-                for x, cell in enumerate(col):
-                    pos = state(x,y)
-                    self.__node_rewards[x, y] = REWARD_NORMAL # implicit
-                    if pos in self.__finish:
-                        self.__node_rewards[x,y] = REWARD_GOAL
-                    if pos in self.hard_places:
-                        self.__node_rewards[x,y] = REWARD_DANGER
+            self.__node_rewards = cells['reward'] # implicit, parsed by the map compiler
+            if goal_nodes is not None:
+                self.__node_rewards = np.array(self.__node_rewards)
+                for place in self.__finish:
+                    if place not in self.hard_places:
+                        self.__node_rewards[place[0], place[1]] = REWARD_GOAL
             print(self.__node_rewards)
 
         if self.__node_utils is None:
@@ -330,7 +364,77 @@ class Maze:
         print('maze init done')
 
     def get_state_reward(self, state):
-        return self.__node_rewards[state.x, state.y]
+        x, y = self.__position(state)
+        return self.__node_rewards[x, y]
+
+    def encode(self, position):
+        '''
+        Returns the compact form of a state, a single int
+        @param position: L{namedtuple state<state>} or (x, y)
+        @return: y*W + x, where W is the x dimension of the problem
+        @rtype: int
+        '''
+        return position[1] * self.__maze.shape[0] + position[0]
+
+    def decode(self, index):
+        '''
+        Returns the namedtuple view of a compact state
+        @param index: int, see L{encode()<encode>}
+        @return: state
+        @rtype: L{namedtuple state<state>}
+        '''
+        y, x = divmod(index, self.__maze.shape[0])
+        return state(x, y)
+
+    def __position(self, current_state):
+        # (x, y) of a state in either form
+        if isinstance(current_state, (int, np.integer)):
+            y, x = divmod(int(current_state), self.__maze.shape[0])
+            return x, y
+        return current_state[0], current_state[1]
+
+    def __get_result_table(self):
+        '''
+        Results of all actions in all states for the compact states, built on the first use
+        @return: memoryview of int32, the result of action a in state i is at [8*i + a]
+        '''
+        if self.__result_table is None:
+            width, height = self.__maze.shape
+            free = self.__maze.T.ravel()  # indexed by y*W + x
+            index = np.arange(width * height)
+            xs, ys = index % width, index // width
+            table = np.empty((width * height, len(self.__deltas)), dtype=np.int32)
+            for a, (dx, dy) in enumerate(self.__deltas):
+                inside = (0 <= xs + dx) & (xs + dx < width) & (0 <= ys + dy) & (ys + dy < height)
+                target = np.where(inside, index + dy * width + dx, index)
+                table[:, a] = np.where(inside & free[target], target, index)
+            self.__result_table = memoryview(table.ravel())
+        return self.__result_table
+
+    def get_transition_model(self):
+        '''
+        Exports the whole transition model at once, for solvers that would otherwise call
+        L{get_next_states_and_probs()<get_next_states_and_probs>} for every state and action.
+        Built on the first call and kept until the probabilities change.
+        @return: arrays of all states, their next states, probabilities and rewards
+        @rtype: L{TransitionModel}
+        '''
+        if self.__transition_model is None:
+            width, height = self.__maze.shape
+            states = np.array(self.get_all_states(compact=True), dtype=np.int64)
+            rows = np.full(width * height, -1, dtype=np.int64)
+            rows[states] = np.arange(len(states))
+            # The first four moves of the result table are the ACTIONs, in their order.
+            table = np.asarray(self.__get_result_table()).reshape(width * height, -1)[states, :len(ACTION)]
+            outcomes = np.array([[out_action.value for out_action in ACTION] for _ in ACTION])
+            probs = np.array(self.__trans_probs.matrix)
+            next_states = rows[table[:, outcomes]]
+            xs, ys = states % width, states // width
+            terminal = np.array([self.is_goal_state(state) or self.is_danger_state(state)
+                                 for state in zip(xs.tolist(), ys.tolist())], dtype=bool)
+            self.__transition_model = TransitionModel(states, next_states, probs,
+                                                      np.array(self.__node_rewards[xs, ys], dtype=float), terminal)
+        return self.__transition_model
 
     def get_start_state(self):
         '''
@@ -360,10 +464,10 @@ class Maze:
         @return: True if state is a goal state, False otherwise
         @rtype: boolean
         '''
-        return state(current_state.x, current_state.y) in self.__finish
+        return self.__position(current_state) in self.__finish
 
     def is_danger_state(self, current_state):
-        return state(current_state.x, current_state.y) in self.hard_places
+        return self.__position(current_state) in self.hard_places
 
     def get_goal_nodes(self):
         '''
@@ -373,12 +477,16 @@ class Maze:
         '''
         return list(self.__finish)
 
-    def get_all_states(self):
+    def get_all_states(self, compact=False):
         '''
         Returns a list of all the problem states
+        @param compact: return the states as ints, see L{encode()<encode>}
         @return: list of all states
-        @rtype: list of L{namedtuple weighted_state<weighted_state>}
+        @rtype: list of L{namedtuple weighted_state<weighted_state>}, or of int if compact
         '''
+        if compact:
+            xs, ys = np.nonzero(self.__maze)  # same order as below
+            return (ys * self.__maze.shape[0] + xs).tolist()
         dims = self.get_dimensions()
         states = []
         for x in range(dims[0]):
@@ -395,6 +503,24 @@ class Maze:
         '''
         return self.__maze.shape
 
+    def get_free_mask(self):
+        '''
+        Returns the occupancy grid of the problem
+        @return: read-only array of shape L{get_dimensions()<get_dimensions>}, indexed [x, y], True where there is no wall
+        @rtype: numpy.ndarray of bool
+        '''
+        mask = self.__maze.view()
+        mask.flags.writeable = False
+        return mask
+
+    def get_deltas(self):
+        '''
+        Returns the moves used by L{result()<result>}, in the order of the action indices
+        @return: list of (dx, dy) tuples
+        @rtype: list
+        '''
+        return [tuple(delta) for delta in self.__deltas]
+
     def get_actions(self, current_state):
         '''
         Generate (yield) actions possible for the current_state
@@ -409,11 +535,13 @@ class Maze:
     def result(self, current_state, action):
         '''
         Apply the action and get the state; deterministic version
-        @param current_state: state L{namedtuple state<state>}
+        @param current_state: state L{namedtuple state<state>}, or compact state (int, see L{encode()<encode>})
         @param action: L{action from ACTION<ACTION>}
-        @return: state (result of the action applied at the current_state)
-        @rtype: L{namedtuple state<state>}
+        @return: state (result of the action applied at the current_state), in the form of current_state
+        @rtype: L{namedtuple state<state>} or int
         '''
+        if isinstance(current_state, (int, np.integer)):
+            return self.__get_result_table()[len(self.__deltas) * current_state + action]
         x, y = self.__deltas[action]
         nx = current_state.x + x  # yet to be change as this is not probabilistic
         ny = current_state.y + y
@@ -428,16 +556,17 @@ class Maze:
     def get_next_states_and_probs(self, curr, action):
         '''
         For the commanded action it generates all posiible outcomes with associated probabilities
-        @param state: state L{namedtuple state<state>}
-        @param action: L{action from ACTION<ACTION>}
-        @return: list of tuples (next_state, probability_of_ending_in_the_next_state)
+        @param state: state L{namedtuple state<state>}, or compact state (int, see L{encode()<encode>})
+        @param action: L{action from ACTION<ACTION>}, or its value
+        @return: list of tuples (next_state, probability_of_ending_in_the_next_state), next_state in the form of curr
         @rtype: list of tuples
         '''
-        states_probs = []
-        for out_action in ACTION:
-            next_state = self.result(curr, out_action.value)
-            states_probs.append((next_state, self.__trans_probs[action, out_action]))
-        return states_probs
+        probs = self.__trans_probs.rows[getattr(action, 'value', action)]
+        if isinstance(curr, (int, np.integer)):
+            table = self.__get_result_table()
+            base = len(self.__deltas) * curr
+            return [(table[base + out_action], probs[out_action]) for out_action in range(len(probs))]
+        return [(self.result(curr, out_action), probs[out_action]) for out_action in range(len(probs))]
 
     def set_explored(self, states):
         '''
@@ -452,9 +581,11 @@ class Maze:
 
     def set_probs(self, obey, confusionL, confusionR, confusion180):
         self.__trans_probs.set_probs(obey, confusionL, confusionR, confusion180)
+        self.__transition_model = None
 
     def set_probs_table(self, obey, confusionL, confusionR, confusion180):
         self.__trans_probs = ActionProbsTable(obey, confusionL, confusionR, confusion180)
+        self.__transition_model = None
 
     def set_visited(self, states):
         '''
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+ALT heuristic (A*, Landmarks, Triangle inequality) with distance tables
+stored on disk.
+"""
+
+import os
+
+import numpy as np
+
+from heuristics import HARD_PLACE_COST, octile
+from search_grid import dijkstra, gradient_offset
+
+#: Directory of the stored distance tables.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'landmark_cache')
+#: Number of landmarks.
+LANDMARKS = 8
+
+
+def build_tables(grid, count=LANDMARKS):
+    '''
+    Picks count landmarks by farthest-point selection and computes their
+    distance tables.
+
+    Returns:
+        numpy.ndarray: shape (2, count, W*H), [0, k] are the costs from
+            landmark k, [1, k] the costs to landmark k.
+    '''
+    free = np.flatnonzero(grid.moves)
+    count = min(count, len(free))
+    tables = np.full((2, count, grid.size), np.inf)
+    if count == 0:
+        return tables
+    # Start from the free cell farthest from the first one, then always add
+    # the cell farthest from all landmarks picked so far.
+    nearest = dijkstra(grid, int(free[0]))
+    for k in range(count):
+        reachable = np.where(np.isfinite(nearest), nearest, -1)
+        landmark = int(np.argmax(reachable))
+        tables[0, k] = dijkstra(grid, landmark)
+        tables[1, k] = dijkstra(grid, landmark, reverse=True)
+        nearest = tables[0, k] if k == 0 else np.minimum(nearest, tables[0, k])
+    return tables
+
+
+def load_tables(grid, count=LANDMARKS, cache_dir=CACHE_DIR):
+    '''
+    Returns the distance tables of the grid, from cache_dir if they were
+    computed before, otherwise computes and stores them there.
+    '''
+    path = os.path.join(cache_dir, '{}_{}.npy'.format(grid.digest(), count))
+    if os.path.exists(path):
+        return np.load(path)
+    tables = build_tables(grid, count)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first, so a parallel reader never sees half of it.
+    temporary = '{}.{}.tmp.npy'.format(path[:-4], os.getpid())
+    np.save(temporary, tables)
+    os.replace(temporary, path)
+    return tables
+
+
+class LandmarkHeuristic:
+    '''
+    Lower bound of the cost from first to second, the same contract as
+    heuristics.GradientHeuristic, but tighter on mazes with walls.
+
+    By the triangle inequality, for every landmark L
+        d(v, t) >= d(L, t) - d(L, v)  and  d(v, t) >= d(v, L) - d(t, L).
+    The tables are computed without the gradient, which is added back here
+    (search_grid.gradient_offset), so one table on disk serves every grad.
+    '''
+
+    def __init__(self, grid, grad, count=LANDMARKS, cache_dir=CACHE_DIR):
+        self.width = grid.width
+        self.grad = (grad[0], grad[1])
+        self.tables = load_tables(grid, count, cache_dir)
+        self.hard = memoryview(grid.hard)
+        self.forward = [memoryview(table) for table in self.tables[0]]
+        self.backward = [memoryview(table) for table in self.tables[1]]
+        self._target = None
+        self._target_costs = None
+
+    def _landmark_costs(self, second):
+        # The costs from and to the goal are the same for a whole search.
+        if self._target != second:
+            index = second[1] * self.width + second[0]
+            self._target = second
+            self._target_costs = [(forward, forward[index], backward, backward[index])
+                                  for forward, backward in zip(self.forward, self.backward)]
+        return self._target_costs
+
+    def __call__(self, first, second):
+        index = first[1] * self.width + first[0]
+        h = octile(first, second)
+        if self.hard[index] and index != second[1] * self.width + second[0]:
+            h += HARD_PLACE_COST
+        for forward, from_target, backward, to_target in self._landmark_costs((second[0], second[1])):
+            from_node = forward[index]
+            if from_node != float('inf'):
+                h = max(h, from_target - from_node)
+            to_node = backward[index]
+            if to_target != float('inf'):
+                h = max(h, to_node - to_target)
+        return h + gradient_offset(self.grad, first, second)
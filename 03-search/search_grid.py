@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Flat-array view of a kuimaze environment, used by the array A* engine.
+"""
+
+import hashlib
+import heapq
+from math import sqrt
+
+import numpy as np
+
+from heuristics import HARD_PLACE_COST
+
+
+class SearchGrid:
+    '''
+    The maze as flat NumPy arrays, where cell (x, y) has index y*W + x.
+
+    Everything that does not change between searches is computed once here:
+    which of the 8 moves are possible from each cell (a bitmask), the flat
+    index offset, the base cost and the length of each move, and the hard
+    place surcharge.
+    The buffers for the search itself (parents, g costs, closed set) are
+    allocated once as well, and only refilled by reset_buffers().
+
+    Searches that run many times in a row can skip even the refill, with
+    next_generation(): closed and seen then hold the number of the search
+    that last wrote them, and a cell only counts if it holds the current one.
+    '''
+
+    #: Number of generations a uint8 can tell apart (0 is never current).
+    GENERATIONS = 255
+
+    def __init__(self, environment):
+        free = np.asarray(environment.get_free_mask(), dtype=bool)
+        self.width, self.height = free.shape
+        self.size = self.width * self.height
+        grad = environment.get_grad()
+        self.grad = (grad[0], grad[1])
+        # free is indexed [x, y], so its transpose flattens to y*W + x.
+        free = np.ascontiguousarray(free.T)
+
+        # Move k is possible from a cell if bit k of moves is set.
+        padded = np.zeros((self.height + 2, self.width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = free
+        moves = np.zeros((self.height, self.width), dtype=np.uint8)
+        # Each step is (bit, index offset, base cost, dx, dy, length), where
+        # length is the cost of the move without the gradient.
+        self.steps = []
+        for k, (dx, dy) in enumerate(environment.get_deltas()):
+            target = padded[1 + dy:1 + dy + self.height, 1 + dx:1 + dx + self.width]
+            moves |= ((free & target).astype(np.uint8) << k)
+            # Same arithmetic as EasyMazeEnv._get_cost, so g costs match
+            # the ones of the other engines to the last bit.
+            vector = [-dx, -dy]
+            z_axis = vector[0] * grad[0] + vector[1] * grad[1]
+            length = pow(pow(vector[0], 2) + pow(vector[1], 2), 1/2)
+            self.steps.append((1 << k, dy * self.width + dx, length + z_axis, dx, dy, length))
+        self.moves = moves.ravel()
+
+        self.hard = np.zeros(self.size, dtype=np.uint8)
+        for place in environment.get_hard_places():
+            self.hard[self.index(place)] = HARD_PLACE_COST
+        # All moves cost their length (1 or sqrt(2)), see JumpPointSearch.
+        self.uniform = grad[0] == 0 and grad[1] == 0 and not self.hard.any()
+
+        self.parents = np.empty(self.size, dtype=np.int32)
+        self.g = np.empty(self.size, dtype=np.float64)
+        self.closed = np.empty(self.size, dtype=np.uint8)
+        # Generation in which parents and g of the cell were set.
+        self.seen = np.zeros(self.size, dtype=np.uint8)
+        self.generation = self.GENERATIONS
+        self._digest = None
+
+    def digest(self):
+        '''
+        Hash of the size, walls and hard places, i.e. everything but the
+        gradient. Used as a key for data precomputed for the map.
+        '''
+        if self._digest is None:
+            digest = hashlib.sha1()
+            digest.update(np.array([self.width, self.height], dtype=np.int64).tobytes())
+            digest.update(self.moves.tobytes())
+            digest.update(self.hard.tobytes())
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def index(self, position):
+        '''
+        Flat index of the position (x, y).
+        '''
+        return position[1] * self.width + position[0]
+
+    def position(self, index):
+        '''
+        Position (x, y) of the flat index.
+        '''
+        return (index % self.width, index // self.width)
+
+    def reset_buffers(self):
+        '''
+        Prepares the search buffers for a new search.
+        '''
+        self.parents.fill(-1)
+        self.g.fill(np.inf)
+        self.closed.fill(0)
+        # closed now holds 1 for "closed", so generations start over.
+        self.generation = self.GENERATIONS
+
+    def reached(self):
+        '''
+        Number of cells given a g cost in the current generation.
+        '''
+        return int(np.count_nonzero(self.seen == self.generation))
+
+    def next_generation(self):
+        '''
+        Prepares the search buffers for a new search without clearing them,
+        and returns its generation. Only once every GENERATIONS searches the
+        stamps are cleared.
+        '''
+        self.generation += 1
+        if self.generation > self.GENERATIONS:
+            self.seen.fill(0)
+            self.closed.fill(0)
+            self.generation = 1
+        return self.generation
+
+    def nbytes(self):
+        '''
+        Memory taken by all arrays, in bytes.
+        '''
+        return sum(array.nbytes for array in (self.moves, self.hard, self.parents,
+                                              self.g, self.closed, self.seen))
+
+    def heuristic(self, index, goal):
+        '''
+        Euclidean distance from the flat index to the goal position,
+        computed the same way as heuristics.heur.
+        '''
+        return sqrt((index % self.width - goal[0])**2 + (index // self.width - goal[1])**2)
+
+    def gradient_offset(self, start, goal):
+        '''
+        What the gradient of the map adds to every path from start to goal,
+        see gradient_offset.
+        '''
+        return gradient_offset(self.grad, start, goal)
+
+    def path_to(self, index):
+        '''
+        Backtracks the parents from the flat index, and returns the path
+        from the start as [(x1, y1), (x2, y2)...].
+        '''
+        path = []
+        parents = memoryview(self.parents)
+        while index != -1:
+            path.append(self.position(index))
+            index = parents[index]
+        return path[::-1]
+
+    def iter_path(self, index):
+        '''
+        Generator of the same path as path_to, from the start, without
+        building the list or its reversed copy: the chain of parents is
+        reversed in place first, so it walks forward from the start.
+        The parents of those nodes are then lost, path_to and iter_path
+        cannot be called for them again before the next search.
+        '''
+        parents = memoryview(self.parents)
+        previous = -1
+        while index != -1:
+            parents[index], previous, index = previous, index, parents[index]
+        index = previous # The start, whose parent is now the next node.
+        while index != -1:
+            yield self.position(index)
+            index = parents[index]
+
+
+def dijkstra(grid, source, reverse=False):
+    '''
+    Costs of the cheapest paths from source to every cell (or from every
+    cell to source, if reverse), with moves costing their length plus the
+    hard place surcharge, i.e. without the gradient (see gradient_offset).
+
+    Returns:
+        numpy.ndarray: float64 costs indexed by y*W + x, inf where unreachable.
+    '''
+    distance = np.full(grid.size, np.inf)
+    done = np.zeros(grid.size, dtype=np.uint8)
+    dist = memoryview(distance)
+    closed = memoryview(done)
+    moves = memoryview(grid.moves)
+    hard = memoryview(grid.hard)
+    steps = [(bit, offset, length) for bit, offset, _, _, _, length in grid.steps]
+    dist[source] = 0
+    openList = [(0, source)]
+    while openList:
+        d, node = heapq.heappop(openList)
+        if closed[node]:
+            continue
+        closed[node] = 1
+        mask = moves[node]
+        for bit, offset, length in steps:
+            if not mask & bit:
+                continue
+            child = node + offset
+            # Walking backward, child -> node is the move, and child pays.
+            newCost = d + length + hard[child if reverse else node]
+            if newCost < dist[child]:
+                dist[child] = newCost
+                heapq.heappush(openList, (newCost, child))
+    return distance
+
+
+def gradient_offset(grad, start, goal):
+    '''
+    What the gradient adds to the cost of a path from start to goal.
+
+    A move d costs |d| - grad . d (plus the hard place surcharge), and the
+    moves of any path from start to goal add up to goal - start, so the
+    gradient adds the same -grad . (goal - start) to every such path,
+    whichever way it goes. It never changes which path is the cheapest.
+
+    That is why the data precomputed for a map (landmark tables, distance
+    fields, the HPA* abstraction) and the searches that need costs that are
+    not negative (D* Lite, ARA*) work on the costs without the gradient:
+    move length plus hard place surcharge, never below 1, which the length
+    of SearchGrid.steps and dijkstra give. The same data then serves every
+    grad of the map, and this term is added to the costs afterwards.
+    start and goal may also be arrays of coordinates.
+    '''
+    return -(grad[0] * (goal[0] - start[0]) + grad[1] * (goal[1] - start[1]))
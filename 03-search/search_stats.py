@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and timers of one search, for monitoring instead of render().
+"""
+
+import time
+
+
+class SearchStats:
+    '''
+    What one Agent.find_path did. Filled only when the agent was made
+    with stats enabled; otherwise none of this is measured.
+
+    expanded    nodes closed
+    generated   entries pushed on the openList, the start included
+    reopened    pushes of a node that was already on the openList with a
+                higher cost (the duplicates that are skipped when popped;
+                for 'list', the entries updated in place)
+    peak_open   largest size of the openList
+    elapsed     wall-clock time of find_path, in seconds
+    expand_time, heuristic_time, queue_time
+                seconds spent in environment.expand, in the heuristic, and
+                in pushing to and popping from the openList
+
+    Fields an engine does not measure stay None: generated and reopened
+    are counted by the 'heap', 'list', 'array' and 'multigoal' engines.
+    'heap' measures all three times, 'list' expand_time and heuristic_time
+    (its openList is scanned inline), 'array' and 'multigoal'
+    heuristic_time and queue_time (they do not call expand).
+    '''
+
+    FIELDS = ('engine', 'heuristic', 'found', 'path_length', 'expanded', 'generated', 'reopened',
+              'peak_open', 'elapsed', 'expand_time', 'heuristic_time', 'queue_time')
+
+    def __init__(self, engine, heuristic):
+        self.engine = engine
+        self.heuristic = heuristic
+        self.found = False
+        self.path_length = 0
+        self.expanded = 0
+        self.generated = None
+        self.reopened = None
+        self.peak_open = 0
+        self.elapsed = 0.0
+        self.expand_time = None
+        self.heuristic_time = None
+        self.queue_time = None
+
+    def timed(self, function, field):
+        '''
+        Returns function, adding the time spent in each call to the field
+        (one of the *_time fields).
+        '''
+        if getattr(self, field) is None:
+            setattr(self, field, 0.0)
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            started = clock()
+            result = function(*args)
+            setattr(self, field, getattr(self, field) + clock() - started)
+            return result
+        return wrapper
+
+    def as_dict(self):
+        '''
+        The fields as a dict, e.g. for json.dumps.
+        '''
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return 'SearchStats({})'.format(', '.join(
+            '{}={!r}'.format(field, getattr(self, field)) for field in self.FIELDS))